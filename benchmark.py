@@ -0,0 +1,241 @@
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from file_index import FileIndex
+from main import sync_folders
+
+# Each profile describes a synthetic tree at scale 1: (folders per level, depth, files per folder, file size in bytes)
+PROFILES = {
+    'small-files': (4, 2, 100, 2 * 1024),
+    'huge-files': (1, 0, 3, 64 * 1024 * 1024),
+    'deep': (1, 200, 2, 4 * 1024),
+    'wide': (1, 0, 5000, 512),
+}
+
+PASSES = ('full', 'noop', 'incremental')
+GENERATE_CHUNK_SIZE = 1024 * 1024
+
+def generate_tree(root, profile, scale=1, seed=0):
+    """Create a reproducible synthetic tree and return (file count, total bytes)."""
+    fanout, depth, files_per_folder, file_size = PROFILES[profile]
+    rng = random.Random(seed)
+    files = 0
+    total_bytes = 0
+    stack = [(root, 0)]
+    while stack:
+        folder, level = stack.pop()
+        os.makedirs(folder, exist_ok=True)
+        for i in range(max(1, int(files_per_folder * scale))):
+            with open(os.path.join(folder, f'file_{i:05d}.bin'), 'wb') as f:
+                # Write in chunks so huge files do not inflate the process's memory
+                for offset in range(0, file_size, GENERATE_CHUNK_SIZE):
+                    f.write(rng.randbytes(min(GENERATE_CHUNK_SIZE, file_size - offset)))
+            files += 1
+            total_bytes += file_size
+        if level < depth:
+            for i in range(fanout):
+                stack.append((os.path.join(folder, f'dir_{i:03d}'), level + 1))
+    return files, total_bytes
+
+def mutate_tree(root, percent, seed=0):
+    """Rewrite, delete or add files for roughly percent of the tree and return the number of mutations."""
+    rng = random.Random(seed)
+    paths = sorted(os.path.join(folder, name) for folder, _, names in os.walk(root) for name in names)
+    # Small trees such as huge-files would otherwise round down to no mutations at all
+    count = min(len(paths), max(1, round(len(paths) * percent / 100))) if percent > 0 else 0
+    mutations = 0
+    for path in rng.sample(paths, count):
+        choice = rng.random()
+        if choice < 0.8:
+            # Rewrite a single block in the middle of the file
+            size = os.path.getsize(path)
+            with open(path, 'r+b') as f:
+                f.seek(size // 2)
+                f.write(rng.randbytes(min(4096, max(1, size - size // 2))))
+        elif choice < 0.9:
+            os.remove(path)
+        else:
+            with open(path + '.new', 'wb') as f:
+                f.write(rng.randbytes(1024))
+        mutations += 1
+    return mutations
+
+def read_io_counters():
+    """Return this process's I/O counters from /proc, or an empty dict where unavailable."""
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except OSError:
+        return {}
+
+def reset_peak_rss():
+    """Reset this process's peak resident set size so the next reading covers only what follows.
+
+    Returns False where the kernel does not support it (Linux before 4.0, other platforms).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_bytes():
+    """Return the peak resident set size of this process since the last reset in bytes, if available."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def measure_pass(source, replica, files, total_bytes, logger, **sync_options):
+    """Run one sync pass and return its timings and resource usage."""
+    # ru_maxrss never goes down, so without a reset every pass would report the peak of tree generation
+    peak_rss_supported = reset_peak_rss()
+    io_before = read_io_counters()
+    start = time.perf_counter()
+    changes_made = sync_folders(source, replica, logger, **sync_options)
+    wall_time = time.perf_counter() - start
+    io_after = read_io_counters()
+    io = {key: io_after[key] - io_before.get(key, 0) for key in io_after}
+    return {
+        'wall_time': wall_time,
+        'changes_made': changes_made,
+        'files_per_s': files / wall_time if wall_time else None,
+        'mb_per_s': total_bytes / wall_time / (1024 * 1024) if wall_time else None,
+        'read_syscalls': io.get('syscr'),
+        'write_syscalls': io.get('syscw'),
+        'bytes_read': io.get('rchar'),
+        'bytes_written': io.get('wchar'),
+        'peak_rss': peak_rss_bytes() if peak_rss_supported else None,
+    }
+
+def run_benchmark(profile, scale=1, mutate_percent=5, seed=0, use_index=False, work_dir=None, **sync_options):
+    """Generate a tree and time a full, a no-op and an incremental pass over it."""
+    # Keep logging out of the measurements
+    logger = logging.getLogger('benchmark')
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    base = tempfile.mkdtemp(prefix='sync-bench-', dir=work_dir)
+    try:
+        source = os.path.join(base, 'source')
+        replica = os.path.join(base, 'replica')
+        os.makedirs(replica)
+        files, total_bytes = generate_tree(source, profile, scale, seed)
+        index = FileIndex(base) if use_index else None
+
+        results = {'files': files, 'bytes': total_bytes, 'passes': {}}
+        results['passes']['full'] = measure_pass(source, replica, files, total_bytes, logger, index=index, **sync_options)
+        results['passes']['noop'] = measure_pass(source, replica, files, total_bytes, logger, index=index, **sync_options)
+        results['mutations'] = mutate_tree(source, mutate_percent, seed)
+        results['passes']['incremental'] = measure_pass(source, replica, files, total_bytes, logger, index=index,
+                                                        **sync_options)
+        if index is not None:
+            index.close()
+        return results
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+def current_commit():
+    """Return the current git commit, if the benchmark runs inside a checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def settings_differences(results, baseline):
+    """Return descriptions of the benchmark settings that differ from the baseline's."""
+    settings = results['settings']
+    baseline_settings = baseline.get('settings', {})
+    return [f"{name}: {baseline_settings.get(name)} -> {settings.get(name)}"
+            for name in sorted(set(settings) | set(baseline_settings))
+            if settings.get(name) != baseline_settings.get(name)]
+
+def find_regressions(results, baseline, threshold):
+    """Return descriptions of passes whose wall time grew by more than threshold percent over the baseline."""
+    regressions = []
+    for profile, profile_results in results['profiles'].items():
+        baseline_profile = baseline.get('profiles', {}).get(profile)
+        if baseline_profile is None:
+            continue
+        for name, measurement in profile_results['passes'].items():
+            previous = baseline_profile['passes'].get(name)
+            if previous is None or not previous['wall_time']:
+                continue
+            change = (measurement['wall_time'] / previous['wall_time'] - 1) * 100
+            if change > threshold:
+                regressions.append(f"{profile}/{name}: {previous['wall_time']:.3f}s -> "
+                                   f"{measurement['wall_time']:.3f}s (+{change:.1f}%)")
+    return regressions
+
+def parse_arguments(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Folder Synchronization Benchmark')
+    parser.add_argument('-p', '--profile', dest="profiles", action='append', choices=sorted(PROFILES), help='Tree profile to benchmark (repeatable, default all)')
+    parser.add_argument('--scale', dest="scale", type=float, default=1, help='Multiplier for the number of files per folder')
+    parser.add_argument('--mutate', dest="mutate", type=float, default=5, help='Percentage of files changed before the incremental pass')
+    parser.add_argument('--seed', dest="seed", type=int, default=0, help='Random seed for tree generation and mutation')
+    parser.add_argument('-w', '--workers', dest="workers", type=int, default=1, help='Number of parallel copy/hash workers')
+    parser.add_argument('-c', '--compare', dest="compare", type=str, default='safe', help='Comparison preset or tiers')
+    parser.add_argument('--index', dest="index", action='store_true', help='Use a file index during the passes')
+    parser.add_argument('--work-dir', dest="work_dir", type=str, default=None, help='Folder to generate trees in')
+    parser.add_argument('-o', '--output', dest="output", type=str, default=None, help='Path to write the JSON results to')
+    parser.add_argument('--baseline', dest="baseline", type=str, default=None, help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', dest="threshold", type=float, default=10, help='Allowed wall time increase over the baseline, in percent')
+    return parser.parse_args(argv)
+
+# Example usage:
+# python benchmark.py -p small-files -p wide -w 8 -o bench.json
+# python benchmark.py -w 8 --baseline bench.json --threshold 15
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    results = {
+        'commit': current_commit(),
+        'timestamp': time.time(),
+        'settings': {'scale': args.scale, 'mutate': args.mutate, 'seed': args.seed, 'workers': args.workers,
+                     'compare': args.compare, 'index': args.index},
+        'profiles': {},
+    }
+    for profile in args.profiles or sorted(PROFILES):
+        results['profiles'][profile] = run_benchmark(profile, args.scale, args.mutate, args.seed, args.index,
+                                                     args.work_dir, workers=args.workers, compare=args.compare)
+        for name in PASSES:
+            measurement = results['profiles'][profile]['passes'][name]
+            print(f"{profile:12} {name:12} {measurement['wall_time']:8.3f}s "
+                  f"{measurement['files_per_s']:10.0f} files/s {measurement['mb_per_s']:8.1f} MB/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differences = settings_differences(results, baseline)
+        if differences:
+            # Timings taken with other settings are not comparable
+            for difference in differences:
+                print(f"Baseline settings differ: {difference}")
+            return 2
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
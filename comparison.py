@@ -0,0 +1,136 @@
+import hashlib
+import os
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+READ_BUFFER_SIZE = 1024 * 1024
+PARTIAL_SPAN = 64 * 1024
+
+DIGESTS = {
+    'md5': hashlib.md5,
+    'sha256': hashlib.sha256,
+    'blake2b': hashlib.blake2b,
+}
+if xxhash is not None:
+    # Non-cryptographic but much faster; fine for detecting changes, not tampering
+    DIGESTS.update({
+        'xxh64': xxhash.xxh64,
+        'xxh3_64': xxhash.xxh3_64,
+        'xxh3_128': xxhash.xxh3_128,
+    })
+
+# Cheapest first. size and partial can only prove a difference, mtime can only
+# prove two files the same, and full always decides.
+TIERS = ('size', 'mtime', 'partial', 'full')
+
+PRESETS = {
+    'md5': ('full',),
+    'mtime': ('mtime',),
+    'fast': ('size', 'mtime', 'partial', 'full'),
+    'safe': ('size', 'partial', 'full'),
+}
+
+def get_digest(algorithm):
+    """Return the hash constructor for a digest name."""
+    try:
+        return DIGESTS[algorithm]
+    except KeyError:
+        raise ValueError(f"Unknown digest '{algorithm}'. Available digests: {', '.join(DIGESTS)}.")
+
+def file_digest(file_path, algorithm='md5'):
+    """Calculate the hex digest of a whole file using large reads into a reused buffer."""
+    digest = get_digest(algorithm)()
+    buffer = bytearray(READ_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+def partial_digest(file_path, algorithm='md5', span=PARTIAL_SPAN):
+    """Calculate a digest of the first and last span bytes of a file."""
+    digest = get_digest(algorithm)()
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(span))
+        size = os.fstat(f.fileno()).st_size
+        if size > span:
+            f.seek(max(span, size - span))
+            digest.update(f.read(span))
+    return digest.hexdigest()
+
+class CompareStrategy:
+    """Cascade of comparison tiers that stops at the first one able to decide."""
+
+    def __init__(self, tiers=PRESETS['md5'], algorithm='md5'):
+        tiers = tuple(tiers)
+        if not tiers:
+            raise ValueError("At least one comparison tier is required.")
+        for tier in tiers:
+            if tier not in TIERS:
+                raise ValueError(f"Invalid comparison tier '{tier}'. Use one of: {', '.join(TIERS)}.")
+        get_digest(algorithm)
+        self.tiers = tiers
+        self.algorithm = algorithm
+
+    @classmethod
+    def from_spec(cls, spec, algorithm='md5'):
+        """Build a strategy from a preset name or a comma-separated list of tiers."""
+        tiers = PRESETS.get(spec) or [tier.strip() for tier in spec.split(',') if tier.strip()]
+        return cls(tiers, algorithm)
+
+    def _full_digest(self, file_path, st, index, metrics, budget):
+        if index is not None:
+            return index.get_digest(file_path, self.algorithm, metrics, st, budget)
+        if metrics is not None:
+            metrics.add('bytes_hashed', st.st_size)
+        if budget is not None:
+            budget.acquire(st.st_size, operations=0)
+        return file_digest(file_path, self.algorithm)
+
+    def compare(self, file1, file2, index=None, metrics=None, budget=None):
+        """Return (equal, tier) where tier is the name of the tier that decided.
+
+        If a FileIndex is given and both full digests are cached, they decide before any
+        tier that would read the files. If a SyncMetrics is given, the deciding tier and
+        the bytes hashed are recorded in it, and a ResourceBudget is charged for the bytes hashed.
+        """
+        stat1 = os.stat(file1)
+        stat2 = os.stat(file2)
+        cache_checked = index is None or 'full' not in self.tiers
+        for position, tier in enumerate(self.tiers):
+            if tier in ('partial', 'full') and not cache_checked:
+                cache_checked = True
+                digest1 = index.peek_digest(file1, self.algorithm, stat1)
+                digest2 = index.peek_digest(file2, self.algorithm, stat2) if digest1 is not None else None
+                if digest2 is not None:
+                    if metrics is not None:
+                        metrics.record_tier('full', digest1 == digest2)
+                    return digest1 == digest2, 'full'
+            if tier == 'size':
+                equal = stat1.st_size == stat2.st_size
+                decisive = not equal
+            elif tier == 'mtime':
+                equal = stat1.st_mtime_ns == stat2.st_mtime_ns
+                decisive = equal
+            elif tier == 'partial':
+                partial_bytes = min(stat1.st_size, 2 * PARTIAL_SPAN) + min(stat2.st_size, 2 * PARTIAL_SPAN)
+                if budget is not None:
+                    budget.acquire(partial_bytes, operations=0)
+                equal = partial_digest(file1, self.algorithm) == partial_digest(file2, self.algorithm)
+                decisive = not equal
+                if metrics is not None:
+                    metrics.add('bytes_hashed', partial_bytes)
+            else:
+                equal = (self._full_digest(file1, stat1, index, metrics, budget)
+                         == self._full_digest(file2, stat2, index, metrics, budget))
+                decisive = True
+            if decisive or position == len(self.tiers) - 1:
+                if metrics is not None:
+                    metrics.record_tier(tier, equal)
+                return equal, tier
@@ -0,0 +1,131 @@
+import argparse
+import configparser
+import os
+from collections import namedtuple
+from logging_setup import setup_logging
+from file_index import FileIndex
+from metrics import MetricsExporter, SyncMetrics, start_metrics_server
+from comparison import CompareStrategy
+from scheduler import Job, ResourceBudget, Scheduler
+from main import log_pass_result, sync_folders
+
+PairConfig = namedtuple('PairConfig', ['name', 'source', 'replica', 'interval', 'priority', 'workers', 'compare',
+                                       'fsync', 'delta_threshold'])
+
+DaemonConfig = namedtuple('DaemonConfig', ['log', 'max_concurrent', 'bandwidth', 'iops', 'stats_file',
+                                           'metrics_port', 'metrics_host', 'pairs'])
+
+# Example config:
+#
+# [daemon]
+# log = /var/log/folder-sync
+# max_concurrent = 4
+# bandwidth = 200
+# iops = 5000
+#
+# [pair:photos]
+# source = /data/photos
+# replica = /mnt/backup/photos
+# interval = 300
+# priority = 10
+# workers = 4
+
+def load_config(config_path):
+    """Load the daemon settings and the list of source/replica pairs from an INI file."""
+    parser = configparser.ConfigParser()
+    if not parser.read(config_path):
+        raise FileNotFoundError(f"The config file '{config_path}' does not exist.")
+    if not parser.has_section('daemon'):
+        raise ValueError(f"The config file '{config_path}' has no [daemon] section.")
+    daemon = parser['daemon']
+
+    pairs = []
+    for section in parser.sections():
+        if not section.startswith('pair:'):
+            continue
+        pair = parser[section]
+        name = section[len('pair:'):].strip()
+        for key in ('source', 'replica', 'interval'):
+            if key not in pair:
+                raise ValueError(f"Pair '{name}' is missing the '{key}' setting.")
+        interval = pair.getint('interval')
+        if interval <= 0:
+            raise ValueError(f"Pair '{name}' needs a positive interval.")
+        if pair.get('fsync', 'none') not in ('none', 'file', 'batch'):
+            raise ValueError(f"Pair '{name}' has an invalid fsync setting, use none, file or batch.")
+        delta_threshold = pair.getint('delta_threshold', 0)
+        pairs.append(PairConfig(
+            name=name,
+            source=pair['source'],
+            replica=pair['replica'],
+            interval=interval,
+            priority=pair.getint('priority', 0),
+            workers=max(1, pair.getint('workers', 1)),
+            compare=CompareStrategy.from_spec(pair.get('compare', 'safe'), pair.get('digest', 'md5')),
+            fsync=pair.get('fsync', 'none'),
+            delta_threshold=delta_threshold * 1024 * 1024 if delta_threshold > 0 else None,
+        ))
+    if not pairs:
+        raise ValueError(f"The config file '{config_path}' defines no [pair:<name>] sections.")
+
+    return DaemonConfig(
+        log=daemon['log'],
+        max_concurrent=daemon.getint('max_concurrent', 1),
+        bandwidth=daemon.getfloat('bandwidth', 0) * 1024 * 1024,
+        iops=daemon.getfloat('iops', 0),
+        stats_file=daemon.get('stats_file'),
+        metrics_port=daemon.getint('metrics_port', 0),
+        metrics_host=daemon.get('metrics_host', '127.0.0.1'),
+        pairs=pairs,
+    )
+
+def make_job(pair, logger, index, budget, exporter):
+    """Create the scheduler job that runs one full pass for a pair."""
+    pair_logger = logger.getChild(pair.name)
+
+    def run():
+        metrics = SyncMetrics()
+        exporter.start_pass('full', metrics, pair.name)
+        changes_made = sync_folders(pair.source, pair.replica, pair_logger, index, pair.workers,
+                                     pair.delta_threshold, pair.compare, pair.fsync, metrics, budget)
+        index.commit()
+        exporter.record_pass('full', metrics, changes_made, pair.name)
+        log_pass_result(changes_made, pair_logger)
+
+    return Job(pair.name, pair.interval, pair.priority, run)
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Folder Synchronization Daemon')
+    parser.add_argument('-c', '--config', dest="config", type=str, required=True, help='Path to the daemon config file')
+    return parser.parse_args()
+
+# Example usage:
+# python daemon.py -c /etc/folder-sync.ini
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    try:
+        config = load_config(args.config)
+    except (FileNotFoundError, ValueError, configparser.Error) as e:
+        raise SystemExit(f"Invalid config: {e}")
+
+    logger = setup_logging(config.log)
+    for pair in config.pairs:
+        for name, path in (('source', pair.source), ('replica', pair.replica)):
+            if not os.path.isdir(path):
+                raise SystemExit(f"{name.capitalize()} path '{path}' of pair '{pair.name}' does not exist.")
+        logger.info(f"Pair '{pair.name}': {pair.source} -> {pair.replica} every {pair.interval} seconds, "
+                    f"priority {pair.priority}")
+    logger.info(f"Max concurrent passes: {config.max_concurrent}")
+
+    index_dir = config.log if os.path.isdir(config.log) else os.path.dirname(os.path.abspath(config.log))
+    index = FileIndex(index_dir)
+    budget = ResourceBudget(config.bandwidth, config.iops)
+    exporter = MetricsExporter(config.stats_file)
+    if config.metrics_port:
+        start_metrics_server(exporter, config.metrics_port, config.metrics_host)
+        logger.info(f"Serving metrics on http://{config.metrics_host}:{config.metrics_port}/metrics")
+
+    jobs = [make_job(pair, logger, index, budget, exporter) for pair in config.pairs]
+    Scheduler(jobs, config.max_concurrent, logger).run()
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import shutil
+import stat
+import struct
+import zlib
+from contextlib import contextmanager
+
+DEFAULT_BLOCK_SIZE = 128 * 1024
+
+# Journal layout: magic, then (offset, length) records each followed by their data,
+# then a commit record whose length field holds the final file size.
+JOURNAL_MAGIC = b'SYNCDJ1\n'
+JOURNAL_RECORD = struct.Struct('>QQ')
+JOURNAL_COMMIT = 0xFFFFFFFFFFFFFFFF
+
+def journal_path_for(path):
+    """Return the path of the journal used while updating a file in place."""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f'.{name}.delta-journal')
+
+def discard_journal(path):
+    """Remove a leftover journal, e.g. after the file was replaced by a full copy."""
+    try:
+        os.remove(journal_path_for(path))
+    except FileNotFoundError:
+        pass
+
+@contextmanager
+def owner_writable(path):
+    """Temporarily give the owner write permission on a read-only file, restoring its mode afterwards."""
+    mode = os.stat(path).st_mode
+    if mode & stat.S_IWUSR:
+        yield
+        return
+    os.chmod(path, stat.S_IMODE(mode) | stat.S_IWUSR)
+    try:
+        yield
+    finally:
+        os.chmod(path, stat.S_IMODE(mode))
+
+def block_checksums(block):
+    """Return the weak (Adler-32) and strong (BLAKE2b) checksums of a block."""
+    return zlib.adler32(block), hashlib.blake2b(block, digest_size=16).digest()
+
+def block_signature(path, block_size=DEFAULT_BLOCK_SIZE):
+    """Return the list of (weak, strong) checksums for each block of a file."""
+    signature = []
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            signature.append(block_checksums(block))
+    return signature
+
+def block_matches(block, checksums):
+    """Check a block against known checksums, computing the strong hash only if the weak one matches."""
+    weak, strong = checksums
+    if zlib.adler32(block) != weak:
+        return False
+    return hashlib.blake2b(block, digest_size=16).digest() == strong
+
+def apply_journal(journal_path, dest):
+    """Apply a committed journal to dest. Incomplete journals are discarded and leave dest untouched."""
+    with open(journal_path, 'rb') as journal:
+        if journal.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            os.remove(journal_path)
+            return False
+        # First make sure the journal was fully written before touching dest
+        final_size = None
+        while True:
+            header = journal.read(JOURNAL_RECORD.size)
+            if len(header) < JOURNAL_RECORD.size:
+                break
+            offset, length = JOURNAL_RECORD.unpack(header)
+            if offset == JOURNAL_COMMIT:
+                final_size = length
+                break
+            journal.seek(length, os.SEEK_CUR)
+        if final_size is None:
+            os.remove(journal_path)
+            return False
+
+        journal.seek(len(JOURNAL_MAGIC))
+        # The replica carries the source's mode, which may be read-only
+        with owner_writable(dest), open(dest, 'r+b') as f:
+            while True:
+                offset, length = JOURNAL_RECORD.unpack(journal.read(JOURNAL_RECORD.size))
+                if offset == JOURNAL_COMMIT:
+                    break
+                f.seek(offset)
+                f.write(journal.read(length))
+            f.truncate(final_size)
+            f.flush()
+            os.fsync(f.fileno())
+    os.remove(journal_path)
+    return True
+
+def recover_journal(dest):
+    """Finish or roll back an in-place update interrupted by a crash."""
+    journal_path = journal_path_for(dest)
+    if os.path.exists(journal_path):
+        return apply_journal(journal_path, dest)
+    return False
+
+def delta_copy(src, dest, block_size=DEFAULT_BLOCK_SIZE, budget=None):
+    """Update dest in place so it matches src, rewriting only the blocks that differ.
+
+    Changed blocks are first written to a journal beside dest and fsynced, then
+    applied, so a crash leaves either the old or the new content once the journal
+    is recovered. Returns the number of changed bytes written.
+
+    If a ResourceBudget is given, it is charged for reading dest and for writing the
+    changed blocks twice; reading src is left to the caller, like a normal copy.
+    """
+    try:
+        recover_journal(dest)
+        if budget is not None:
+            budget.acquire(os.path.getsize(dest), operations=0)
+        signature = block_signature(dest, block_size)
+        journal_path = journal_path_for(dest)
+        bytes_changed = 0
+        with open(src, 'rb') as source, open(journal_path, 'wb') as journal:
+            journal.write(JOURNAL_MAGIC)
+            size = 0
+            for index, block in enumerate(iter(lambda: source.read(block_size), b'')):
+                if index >= len(signature) or not block_matches(block, signature[index]):
+                    journal.write(JOURNAL_RECORD.pack(index * block_size, len(block)))
+                    journal.write(block)
+                    bytes_changed += len(block)
+                size += len(block)
+            journal.write(JOURNAL_RECORD.pack(JOURNAL_COMMIT, size))
+            journal.flush()
+            os.fsync(journal.fileno())
+        if budget is not None:
+            # Each changed block is written to the journal and then to dest
+            budget.acquire(2 * bytes_changed, operations=0)
+        apply_journal(journal_path, dest)
+        shutil.copystat(src, dest)
+        return bytes_changed
+    except FileNotFoundError:
+        raise FileNotFoundError(f"The source '{src}' or replica '{dest}' does not exist.")
+    except PermissionError:
+        raise PermissionError(f"Permission denied to access '{src}' or '{dest}'.")
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import threading
+from comparison import file_digest
+
+INDEX_FILE_NAME = 'sync_index.db'
+
+class FileIndex:
+    """Persistent cache of file digests keyed by path and validated by stat."""
+
+    def __init__(self, index_path):
+        # Accept either a directory (the log/state folder) or a database file
+        if os.path.isdir(index_path):
+            index_path = os.path.join(index_path, INDEX_FILE_NAME)
+        self.path = index_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "algorithm TEXT, digest TEXT)"
+        )
+        self._conn.commit()
+
+    def _lookup(self, path, st, algorithm):
+        row = self._conn.execute(
+            "SELECT size, mtime_ns, inode, algorithm, digest FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[:4] == (st.st_size, st.st_mtime_ns, st.st_ino, algorithm):
+            return row[4]
+        return None
+
+    def _store(self, path, st, algorithm, digest):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, algorithm, digest) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, st.st_ino, algorithm, digest),
+        )
+
+    def get_digest(self, file_path, algorithm='md5', metrics=None, st=None, budget=None):
+        """Return the digest of a file, re-reading it only if its stat tuple changed.
+
+        Pass st if the caller already has the file's stat result, to save a second stat call.
+        Re-reading the file is charged to budget, if given.
+        """
+        path = os.path.abspath(file_path)
+        if st is None:
+            st = os.stat(path)
+        with self._lock:
+            digest = self._lookup(path, st, algorithm)
+        if digest is None:
+            if budget is not None:
+                budget.acquire(st.st_size, operations=0)
+            digest = file_digest(path, algorithm)
+            if metrics is not None:
+                metrics.add('bytes_hashed', st.st_size)
+            with self._lock:
+                self._store(path, st, algorithm, digest)
+        return digest
+
+    def get_md5(self, file_path):
+        """Return the MD5 of a file, re-reading it only if its stat tuple changed."""
+        return self.get_digest(file_path, 'md5')
+
+    def peek_digest(self, file_path, algorithm='md5', st=None):
+        """Return the cached digest of a file if it is still valid, without hashing it."""
+        path = os.path.abspath(file_path)
+        if st is None:
+            st = os.stat(path)
+        with self._lock:
+            return self._lookup(path, st, algorithm)
+
+    def record(self, file_path, digest, algorithm='md5'):
+        """Record a known digest for a file, e.g. a replica copy that was just written."""
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        with self._lock:
+            self._store(path, st, algorithm, digest)
+
+    def forget(self, path):
+        """Drop a file, or everything below a directory, from the index."""
+        path = os.path.abspath(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM files WHERE path = ? OR substr(path, 1, ?) = ?",
+                (path, len(prefix), prefix),
+            )
+
+    def verify_sample(self, sample_size, logger, budget=None):
+        """Re-hash a random sample of indexed files and report digests that changed under an unchanged stat.
+
+        The bytes re-read are charged to budget, if given.
+        """
+        with self._lock:
+            # Let SQLite pick the sample so the whole index is never loaded into memory
+            rows = self._conn.execute(
+                "SELECT path, size, mtime_ns, inode, algorithm, digest FROM files ORDER BY RANDOM() LIMIT ?",
+                (max(0, sample_size),),
+            ).fetchall()
+        corrupted = []
+        for path, size, mtime_ns, inode, algorithm, digest in rows:
+            try:
+                st = os.stat(path)
+                if (st.st_size, st.st_mtime_ns, st.st_ino) != (size, mtime_ns, inode):
+                    # The file changed legitimately; the next pass will re-hash it
+                    continue
+                if budget is not None:
+                    budget.acquire(size, operations=0)
+                actual = file_digest(path, algorithm)
+            except FileNotFoundError:
+                self.forget(path)
+                continue
+            except PermissionError as e:
+                logger.error(f"Permission error: {e}")
+                continue
+            if actual != digest:
+                logger.warning(f"Verification failed for {path}: content changed without a stat change")
+                # Storing the real digest makes the next comparison see the mismatch and re-copy
+                with self._lock:
+                    self._store(path, st, algorithm, actual)
+                corrupted.append(path)
+        logger.info(f"Verified {len(rows)} indexed files, {len(corrupted)} mismatches found.")
+        return corrupted
+
+    def commit(self):
+        """Flush pending index updates to disk."""
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        """Commit and close the index database."""
+        self.commit()
+        self._conn.close()
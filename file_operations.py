@@ -1,6 +1,21 @@
+import errno
 import os
-import hashlib
 import shutil
+import tempfile
+import threading
+from functools import partial
+from comparison import CompareStrategy, file_digest
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request that makes the destination share the source's extents (btrfs, XFS)
+FICLONE = 0x40049409
+
+# Errors meaning a fast path is not supported for this pair of files, not that the copy failed
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF}
 
 def list_files_and_directories(folder_path):
     """List all files and directories in the given folder."""
@@ -13,33 +28,133 @@ def list_files_and_directories(folder_path):
 
 def get_file_md5(file_path):
     """Calculate the MD5 hash of a file."""
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-def compare_files(file1, file2, method='md5'):
-    """Compare two files using modification time or MD5 hash."""
-    if method == 'mtime':
-        return os.path.getmtime(file1) == os.path.getmtime(file2)
-    elif method == 'md5':
-        return get_file_md5(file1) == get_file_md5(file2)
-    else:
-        raise ValueError("Invalid comparison method. Use 'mtime' or 'md5'.")
-
-def copy_files_and_directories(src, dest):
-    """Copy files and directories from src to dest."""
+    return file_digest(file_path, 'md5')
+
+def compare_files(file1, file2, method='md5', index=None, metrics=None, budget=None):
+    """Compare two files using modification time, MD5 hash or a CompareStrategy.
+
+    method may also be a preset name or a comma-separated list of comparison tiers
+    such as 'size,mtime,partial,full'. When an index is given, full-content digests
+    are served from it for files whose size, mtime and inode have not changed since
+    they were last hashed. Bytes read for hashing are charged to budget, if given.
+    """
+    if not isinstance(method, CompareStrategy):
+        method = CompareStrategy.from_spec(method)
+    return method.compare(file1, file2, index, metrics, budget)[0]
+
+class FsyncBatch:
+    """Collects copied files so they and their folders are fsynced once at the end of a pass."""
+
+    def __init__(self):
+        self._paths = set()
+        self._lock = threading.Lock()
+
+    def add(self, path):
+        with self._lock:
+            self._paths.add(path)
+
+    def flush(self):
+        """Fsync every collected file, then each of their folders once."""
+        with self._lock:
+            paths, self._paths = self._paths, set()
+        for path in paths:
+            fsync_path(path)
+        for folder in {os.path.dirname(path) for path in paths}:
+            fsync_path(folder)
+
+def fsync_path(path):
+    """Flush a file or folder to stable storage; folders are skipped where they cannot be opened."""
+    flags = os.O_RDONLY
+    if os.path.isdir(path):
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        flags |= os.O_DIRECTORY
+    fd = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def copy_file_contents(src_fd, dest_fd):
+    """Copy file data between descriptors using the fastest mechanism available.
+
+    Tries a FICLONE reflink, then os.copy_file_range, then os.sendfile, and finally
+    a plain buffered copy. Returns the name of the mechanism used.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(dest_fd, FICLONE, src_fd)
+            return 'reflink'
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+
+    for name in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, name):
+            continue
+        copied = 0
+        try:
+            while True:
+                if name == 'copy_file_range':
+                    count = os.copy_file_range(src_fd, dest_fd, 1024 * 1024 * 1024)
+                else:
+                    count = os.sendfile(dest_fd, src_fd, None, 1024 * 1024 * 1024)
+                if count == 0:
+                    return name
+                copied += count
+        except OSError as e:
+            # Only fall back if nothing was written yet, otherwise the destination is inconsistent
+            if copied or e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+
+    with open(src_fd, 'rb', closefd=False) as fsrc, open(dest_fd, 'wb', closefd=False) as fdest:
+        shutil.copyfileobj(fsrc, fdest, 1024 * 1024)
+    return 'buffered'
+
+def copy_file_atomic(src, dest, fsync=None):
+    """Copy a file through a temporary file in the destination folder and rename it into place.
+
+    Readers see either the old or the new file, never a partial one. fsync may be True
+    to flush the file before the rename, or an FsyncBatch to flush it later.
+    """
+    folder, name = os.path.split(dest)
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.synctmp', dir=folder or None)
+    try:
+        with open(src, 'rb') as fsrc, os.fdopen(fd, 'wb') as fdest:
+            copy_file_contents(fsrc.fileno(), fdest.fileno())
+            if fsync is True:
+                os.fsync(fdest.fileno())
+        shutil.copystat(src, temp_path)
+        os.replace(temp_path, dest)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if fsync is True:
+        fsync_path(folder or os.curdir)
+    elif isinstance(fsync, FsyncBatch):
+        fsync.add(dest)
+    return dest
+
+def copy_files_and_directories(src, dest, fsync=None):
+    """Copy files and directories from src to dest, replacing each file atomically."""
     try:
         if os.path.isdir(src):
-            shutil.copytree(src, dest)
+            shutil.copytree(src, dest, copy_function=partial(copy_file_atomic, fsync=fsync))
         else:
-            shutil.copy2(src, dest)
+            copy_file_atomic(src, dest, fsync)
     except FileNotFoundError:
         raise FileNotFoundError(f"The source '{src}' does not exist.")
     except PermissionError:
         raise PermissionError(f"Permission denied to access '{src}' or '{dest}'.")
 
+def make_directory(path):
+    """Create a directory, including any missing parents."""
+    try:
+        os.makedirs(path, exist_ok=True)
+    except PermissionError:
+        raise PermissionError(f"Permission denied to create '{path}'.")
+
 def remove_files_and_directories(path):
     """Remove files and directories."""
     try:
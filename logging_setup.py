@@ -1,5 +1,8 @@
 import os
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 def setup_logging(log_file):
     logger = logging.getLogger('folder_sync')
@@ -34,8 +37,13 @@ def setup_logging(log_file):
     console_handler.setFormatter(formatter)
     file_handler.setFormatter(formatter)
 
-    # Add handlers to the logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    # Hand records to a background listener so console and file I/O never stall the sync loop
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # Add the queue handler to the logger
+    logger.addHandler(QueueHandler(log_queue))
 
     return logger
\ No newline at end of file
@@ -1,8 +1,17 @@
 import argparse
 import os
 import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from logging_setup import setup_logging
-from file_operations import compare_files, copy_files_and_directories, remove_files_and_directories
+from file_index import FileIndex
+from metrics import MetricsExporter, SyncMetrics, start_metrics_server
+from comparison import DIGESTS, PRESETS, CompareStrategy
+from delta_transfer import delta_copy, discard_journal
+from transfer import CODECS, DEFAULT_BATCH_BYTES, connect_receiver, spawn_local_receiver
+from scheduler import next_slot
+from watcher import InotifyWatcher, inotify_available, reduce_paths
+from file_operations import FsyncBatch, compare_files, copy_files_and_directories, make_directory, remove_files_and_directories
 
 def parse_arguments():
     """Parse command line arguments."""
@@ -11,6 +20,20 @@ def parse_arguments():
     parser.add_argument('-r', '--replica', dest="replica", type=str, required=True, help='Path to the replica folder')
     parser.add_argument('-l', '--log', dest="log", type=str, required=True, help='Path to the log folder')
     parser.add_argument('-i', '--interval', dest="interval", type=int, required=True, help='Synchronization interval in seconds')
+    parser.add_argument('-c', '--compare', dest="compare", type=str, default='safe', help=f"Comparison preset ({', '.join(PRESETS)}) or comma-separated tiers from size, mtime, partial, full")
+    parser.add_argument('--digest', dest="digest", type=str, default='md5', choices=sorted(DIGESTS), help='Digest used by the partial and full comparison tiers')
+    parser.add_argument('--fsync', dest="fsync", choices=['none', 'file', 'batch'], default='none', help='Flush copied files to disk: never, before each rename, or once per pass')
+    parser.add_argument('--delta-threshold', dest="delta_threshold", type=int, default=0, help='Update modified files of at least this many MB in place, rewriting only changed blocks (0 disables)')
+    parser.add_argument('--verify-sample', dest="verify_sample", type=int, default=0, help='Number of indexed files to re-hash after each pass to detect bit-rot')
+    parser.add_argument('--watch', dest="watch", action='store_true', help='Sync changes as they happen using inotify; the interval becomes the full reconciliation period')
+    parser.add_argument('--debounce', dest="debounce", type=float, default=0.2, help='Seconds of quiet to wait for before syncing watched changes')
+    parser.add_argument('--stats-file', dest="stats_file", type=str, default=None, help='Append per-pass metrics as JSON lines to this file')
+    parser.add_argument('--transfer', dest="transfer", type=str, default=None, help="Apply changes through a receiver process: 'pipe' starts one locally, host:port connects to a remote one")
+    parser.add_argument('--transfer-codec', dest="transfer_codec", choices=sorted(CODECS), default='zlib', help='Compression used for transfer batches')
+    parser.add_argument('--batch-size', dest="batch_size", type=int, default=DEFAULT_BATCH_BYTES // (1024 * 1024), help='Send a transfer batch once this many MB are pending')
+    parser.add_argument('--metrics-port', dest="metrics_port", type=int, default=0, help='Serve Prometheus metrics on this port (0 disables)')
+    parser.add_argument('--metrics-host', dest="metrics_host", type=str, default='127.0.0.1', help='Address to serve Prometheus metrics on')
+    parser.add_argument('-w', '--workers', dest="workers", type=int, default=1, help='Number of parallel copy/hash workers')
     return parser.parse_args()
 
 # Example usage:
@@ -36,51 +59,358 @@ def validate_interval(interval):
         except ValueError:
             interval = input("Invalid interval. Please enter a valid synchronization interval in seconds: ")
 
-def sync_folders(source, replica, logger):
-    """Synchronize the source folder with the replica folder."""
-    changes_made = 0
+# 'error' actions carry an exception raised while planning, to be reported like any other failure
+SyncAction = namedtuple('SyncAction', ['kind', 'source', 'replica', 'error'], defaults=(None,))
+
+# Settings shared by every action of a pass
+SyncOptions = namedtuple('SyncOptions', ['index', 'workers', 'delta_threshold', 'strategy', 'fsync', 'metrics', 'budget',
+                                         'transport'])
+
+def plan_copy_tree(source, replica):
+    """Yield the actions needed to copy a whole folder, creating parents before children."""
+    return plan_sync(source, replica, replica_exists=False)
+
+def plan_sync(source, replica, replica_exists=True):
+    """Yield the mkdir, copy, compare and delete actions that make replica match source.
+
+    The tree is walked with os.scandir and an explicit stack, so only one folder
+    listing is held at a time and tree depth is not limited by the recursion limit.
+    A folder that cannot be listed is skipped, yielding an 'error' action, and the
+    rest of the tree is still synced.
+    """
+    stack = [(source, replica, replica_exists)]
+    while stack:
+        source_folder, replica_folder, exists = stack.pop()
+        try:
+            with os.scandir(source_folder) as entries:
+                source_entries = list(entries)
+            replica_entries = {}
+            if exists:
+                with os.scandir(replica_folder) as entries:
+                    replica_entries = {entry.name: entry for entry in entries}
+        except OSError as e:
+            # Without both listings nothing in this folder can safely be copied or deleted
+            yield SyncAction('error', source_folder, replica_folder, e)
+            continue
+        if not exists:
+            yield SyncAction('mkdir', source_folder, replica_folder)
+
+        subfolders = []
+        for entry in source_entries:
+            replica_entry = replica_entries.pop(entry.name, None)
+            replica_item_path = os.path.join(replica_folder, entry.name)
+            # A replica item of the wrong type has to go before the source item can take its place
+            if replica_entry is not None and replica_entry.is_dir() != entry.is_dir():
+                yield SyncAction('replace', None, replica_item_path)
+                replica_entry = None
+
+            if entry.is_dir():
+                subfolders.append((entry.path, replica_item_path, replica_entry is not None))
+            elif replica_entry is None:
+                yield SyncAction('copy', entry.path, replica_item_path)
+            else:
+                yield SyncAction('compare', entry.path, replica_item_path)
+
+        # Whatever was not matched by a source entry no longer exists in the source
+        for entry in replica_entries.values():
+            yield SyncAction('delete', os.path.join(source_folder, entry.name), entry.path)
+        stack.extend(reversed(subfolders))
+
+def run_action(action, logger, options):
+    """Perform a single sync action and return the number of changes made.
+
+    Modified files of at least options.delta_threshold bytes are updated in place block by block.
+    """
+    index = options.index
+    metrics = options.metrics
     try:
-        source_items = os.listdir(source)
-        replica_items = os.listdir(replica)
-
-        for item in source_items:
-            source_item_path = os.path.join(source, item)
-            replica_item_path = os.path.join(replica, item)
-
-            if os.path.isdir(source_item_path):
-                if item not in replica_items:
-                    logger.info(f"Copying folder {source_item_path} to {replica_item_path}")
-                    copy_files_and_directories(source_item_path, replica_item_path)
-                    changes_made += 1
+        if options.budget is not None:
+            # Every action costs an operation; copies are charged their bytes below
+            options.budget.acquire()
+        if action.kind == 'error':
+            raise action.error
+        if action.kind == 'mkdir':
+            logger.info(f"Creating folder {action.replica}")
+            if options.transport is not None:
+                options.transport.send_mkdir(action.replica)
+            else:
+                make_directory(action.replica)
+            metrics.add('folders_created')
+            return 1
+        if action.kind in ('delete', 'replace'):
+            logger.info(f"Removing {action.replica}")
+            with metrics.phase('delete'):
+                if options.transport is not None:
+                    options.transport.send_delete(action.replica)
                 else:
-                    changes_made += sync_folders(source_item_path, replica_item_path, logger)
+                    remove_files_and_directories(action.replica)
+                if index is not None:
+                    index.forget(action.replica)
+                    if action.source is not None:
+                        # The source item is gone too, so its cached digests would never be used again
+                        index.forget(action.source)
+            metrics.add('files_deleted')
+            return 1
+        if action.kind == 'compare':
+            metrics.add('files_compared')
+            with metrics.phase('compare'):
+                if compare_files(action.source, action.replica, method=options.strategy, index=index, metrics=metrics,
+                                 budget=options.budget):
+                    return 0
+        if options.budget is not None:
+            # Reading the source costs the same whether it is copied, sent or delta-updated
+            options.budget.acquire(os.path.getsize(action.source), operations=0)
+        with metrics.phase('copy'):
+            if options.transport is not None:
+                logger.info(f"Sending file {action.source} to {action.replica}")
+                options.transport.send_file(action.source, action.replica)
+                bytes_changed = os.path.getsize(action.source)
+            elif (action.kind == 'compare' and options.delta_threshold is not None
+                    and os.path.getsize(action.source) >= options.delta_threshold and os.path.isfile(action.replica)):
+                try:
+                    bytes_changed = delta_copy(action.source, action.replica, budget=options.budget)
+                    logger.info(f"Updating file {action.replica} from {action.source} ({bytes_changed} bytes changed)")
+                except PermissionError as e:
+                    # A full copy goes through a new file, so it does not need write access to the replica
+                    logger.warning(f"Cannot update {action.replica} in place ({e}), copying it instead")
+                    copy_files_and_directories(action.source, action.replica, options.fsync)
+                    discard_journal(action.replica)
+                    bytes_changed = os.path.getsize(action.source)
             else:
-                if item not in replica_items or not compare_files(source_item_path, replica_item_path, method='md5'):
-                    logger.info(f"Copying file {source_item_path} to {replica_item_path}")
-                    copy_files_and_directories(source_item_path, replica_item_path)
-                    changes_made += 1
+                logger.info(f"Copying file {action.source} to {action.replica}")
+                copy_files_and_directories(action.source, action.replica, options.fsync)
+                bytes_changed = os.path.getsize(action.source)
+        metrics.add('files_copied')
+        metrics.add('bytes_copied', bytes_changed)
+        if index is not None and options.transport is None:
+            # The replica now matches the source, so reuse its digest instead of re-reading it next pass
+            digest = index.peek_digest(action.source, options.strategy.algorithm)
+            if digest is not None:
+                index.record(action.replica, digest, options.strategy.algorithm)
+        return 1
+    except PermissionError as e:
+        logger.error(f"Permission error: {e}")
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {e}")
+    except Exception as e:
+        logger.error(f"Error during synchronization: {e}")
+    metrics.add('errors')
+    return 0
+
+def timed_actions(actions, metrics):
+    """Yield planned actions, counting the time spent producing them as the scan phase."""
+    iterator = iter(actions)
+    while True:
+        with metrics.phase('scan'):
+            action = next(iterator, None)
+        if action is None:
+            return
+        yield action
 
-        for item in replica_items:
-            if item not in source_items:
-                replica_item_path = os.path.join(replica, item)
-                logger.info(f"Removing {replica_item_path}")
-                remove_files_and_directories(replica_item_path)
-                changes_made += 1
+def drain_futures(futures, metrics, backlog=0):
+    """Wait for queued actions as they finish, keeping the queue depth current, and return the changes made."""
+    changes_made = 0
+    while futures:
+        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+        changes_made += sum(future.result() for future in done)
+        metrics.set_queue_depth(len(futures) + backlog)
+    return changes_made
 
-        return changes_made
+def execute_actions(actions, logger, options):
+    """Run planned sync actions and return the number of changes made.
 
+    With more than one worker, compares and copies run on a thread pool. Folders are
+    always created, and replica items of the wrong type removed, before anything is
+    copied into their place, and deletions run only after every copy has finished.
+    The queue depth counts both the queued actions and the deferred deletions.
+    """
+    changes_made = 0
+    deletions = []
+    workers = options.workers
+    metrics = options.metrics
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = set()
+    try:
+        for action in timed_actions(actions, metrics):
+            if action.kind == 'delete':
+                deletions.append(action)
+                metrics.set_queue_depth(len(pending) + len(deletions))
+            elif executor is None or action.kind in ('mkdir', 'replace', 'error'):
+                changes_made += run_action(action, logger, options)
+            else:
+                pending.add(executor.submit(run_action, action, logger, options))
+                metrics.set_queue_depth(len(pending) + len(deletions))
+                # Bound the number of queued actions so huge trees are not planned all at once
+                if len(pending) >= workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    changes_made += sum(future.result() for future in done)
+                    metrics.set_queue_depth(len(pending) + len(deletions))
     except PermissionError as e:
         logger.error(f"Permission error: {e}")
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
     except Exception as e:
         logger.error(f"Error during synchronization: {e}")
-    return 0
+
+    if executor is None:
+        for position, action in enumerate(deletions, 1):
+            changes_made += run_action(action, logger, options)
+            metrics.set_queue_depth(len(deletions) - position)
+    else:
+        with executor:
+            changes_made += drain_futures(pending, metrics, len(deletions))
+            futures = {executor.submit(run_action, action, logger, options) for action in deletions}
+            changes_made += drain_futures(futures, metrics)
+    metrics.set_queue_depth(0)
+
+    if isinstance(options.fsync, FsyncBatch):
+        try:
+            options.fsync.flush()
+        except OSError as e:
+            logger.error(f"Error during synchronization: {e}")
+
+    if options.transport is not None:
+        try:
+            report = options.transport.finish()
+        except (OSError, EOFError) as e:
+            logger.error(f"Transfer error: {e}")
+        else:
+            for error in report['errors']:
+                logger.error(f"Error during synchronization: {error}")
+            # Each failed operation was counted as a change when it was sent
+            changes_made -= len(report['errors'])
+            options.metrics.add('errors', len(report['errors']))
+            if report['operations']:
+                logger.info(f"Transferred {report['operations']} operations in {report['batches']} batches, "
+                            f"{report['raw_bytes']} bytes packed into {report['wire_bytes']} bytes sent.")
+    return changes_made
+
+def make_options(index=None, workers=1, delta_threshold=None, compare='md5', fsync='none', metrics=None, budget=None,
+                 transport=None):
+    """Bundle the settings of a pass, resolving compare into a CompareStrategy.
+
+    fsync is 'none', 'file' to flush every copy before it is renamed into place,
+    or 'batch' to flush all copies once the pass has finished. A fresh SyncMetrics
+    is used unless one is given. budget is an optional ResourceBudget shared with
+    other passes to cap their combined bandwidth and IOPS. transport is an optional
+    BatchSender that applies changes through a receiver instead of writing the replica directly.
+    """
+    strategy = compare if isinstance(compare, CompareStrategy) else CompareStrategy.from_spec(compare)
+    fsync = {'none': None, 'file': True, 'batch': FsyncBatch()}[fsync]
+    return SyncOptions(index, workers, delta_threshold, strategy, fsync, metrics or SyncMetrics(), budget, transport)
+
+def sync_folders(source, replica, logger, index=None, workers=1, delta_threshold=None, compare='md5', fsync='none',
+                 metrics=None, budget=None, transport=None):
+    """Synchronize the source folder with the replica folder.
+
+    If a FileIndex is given, unchanged files are compared using their cached digests.
+    compare is a CompareStrategy, preset name or comma-separated list of comparison tiers.
+    Pass a SyncMetrics to collect timings and counters for the pass.
+    """
+    options = make_options(index, workers, delta_threshold, compare, fsync, metrics, budget, transport)
+    return execute_actions(plan_sync(source, replica), logger, options)
+
+def plan_paths(source, replica, rel_paths):
+    """Yield the actions needed to bring only the given relative paths up to date."""
+    climbed = set()
+    for rel_path in rel_paths:
+        # Climb to the nearest folder that already exists in the replica
+        while rel_path and not os.path.isdir(os.path.join(replica, os.path.dirname(rel_path))):
+            rel_path = os.path.dirname(rel_path)
+        climbed.add(rel_path)
+
+    for rel_path in reduce_paths(climbed):
+        source_path = os.path.join(source, rel_path) if rel_path else source
+        replica_path = os.path.join(replica, rel_path) if rel_path else replica
+
+        if os.path.isdir(source_path):
+            if os.path.isdir(replica_path):
+                yield from plan_sync(source_path, replica_path)
+            else:
+                # A file now stands where the folder has to go
+                if os.path.lexists(replica_path):
+                    yield SyncAction('replace', None, replica_path)
+                yield from plan_copy_tree(source_path, replica_path)
+        elif os.path.exists(source_path):
+            if os.path.isdir(replica_path):
+                yield SyncAction('replace', None, replica_path)
+                yield SyncAction('copy', source_path, replica_path)
+            else:
+                yield SyncAction('compare' if os.path.exists(replica_path) else 'copy', source_path, replica_path)
+        elif os.path.lexists(replica_path):
+            yield SyncAction('delete', source_path, replica_path)
+
+def sync_paths(source, replica, rel_paths, logger, index=None, workers=1, delta_threshold=None, compare='md5',
+               fsync='none', metrics=None, budget=None, transport=None):
+    """Synchronize only the given paths, relative to the source and replica folders."""
+    options = make_options(index, workers, delta_threshold, compare, fsync, metrics, budget, transport)
+    return execute_actions(plan_paths(source, replica, rel_paths), logger, options)
+
+def log_pass_result(changes_made, logger):
+    """Log the outcome of a synchronization pass."""
+    if changes_made > 0:
+        logger.info(f"Synchronization completed successfully. {changes_made} changes made.")
+    else:
+        logger.info("No files changed.")
+
+def run_full_pass(args, logger, index, exporter):
+    """Run one full reconciliation pass over the whole tree."""
+    metrics = SyncMetrics()
+    exporter.start_pass('full', metrics)
+    changes_made = sync_folders(args.source, args.replica, logger, index, args.workers, args.delta_threshold,
+                                 args.compare, args.fsync, metrics, transport=args.transport)
+    if args.verify_sample > 0:
+        index.verify_sample(args.verify_sample, logger)
+    index.commit()
+    exporter.record_pass('full', metrics, changes_made)
+    log_pass_result(changes_made, logger)
+
+def watch_folders(args, logger, index, exporter):
+    """Sync changed paths as inotify reports them, with a full pass every interval as a safety net.
+
+    Returns if the tree cannot be watched any more, so the caller can fall back to periodic passes.
+    """
+    try:
+        watcher = InotifyWatcher(args.source, logger)
+    except OSError as e:
+        logger.warning(f"Cannot watch {args.source}: {e}. Falling back to periodic full passes.")
+        return
+    # Start watching before the first full pass so no change falls between the two
+    run_full_pass(args, logger, index, exporter)
+    next_full_pass = time.monotonic() + args.interval
+    while True:
+        timeout = max(0, next_full_pass - time.monotonic())
+        try:
+            rel_paths, overflowed = watcher.collect_changes(timeout, args.debounce)
+        except OSError as e:
+            watcher.close()
+            logger.warning(f"Watching stopped: {e}. Falling back to periodic full passes.")
+            return
+        if overflowed:
+            logger.warning("Change events were lost, running a full reconciliation pass.")
+        if overflowed or time.monotonic() >= next_full_pass:
+            run_full_pass(args, logger, index, exporter)
+            next_full_pass = time.monotonic() + args.interval
+        elif rel_paths:
+            metrics = SyncMetrics()
+            exporter.start_pass('incremental', metrics)
+            changes_made = sync_paths(args.source, args.replica, rel_paths, logger, index, args.workers,
+                                       args.delta_threshold, args.compare, args.fsync, metrics,
+                                       transport=args.transport)
+            index.commit()
+            exporter.record_pass('incremental', metrics, changes_made)
+            logger.info(f"Incremental sync of {len(rel_paths)} paths completed. {changes_made} changes made.")
 
 if __name__ == "__main__":
     args = parse_arguments()
     args.source, args.replica, args.log = validate_paths(args.source, args.replica, args.log)
     args.interval = validate_interval(args.interval)
+    args.workers = max(1, args.workers)
+    try:
+        args.compare = CompareStrategy.from_spec(args.compare, args.digest)
+    except ValueError as e:
+        raise SystemExit(f"Invalid --compare option: {e}")
+    args.delta_threshold = args.delta_threshold * 1024 * 1024 if args.delta_threshold > 0 else None
 
     logger = setup_logging(args.log)
     
@@ -88,11 +418,42 @@ if __name__ == "__main__":
     logger.info(f"Replica folder: {args.replica}")
     logger.info(f"Logs folder: {args.log}")
     logger.info(f"Sync interval: {args.interval} seconds")
+    logger.info(f"Workers: {args.workers}")
+    logger.info(f"Comparison: {', '.join(args.compare.tiers)} ({args.compare.algorithm})")
+
+    # Keep the digest index next to the logs so it survives restarts
+    index_dir = args.log if os.path.isdir(args.log) else os.path.dirname(os.path.abspath(args.log))
+    index = FileIndex(index_dir)
+    logger.info(f"File index: {index.path}")
+
+    exporter = MetricsExporter(args.stats_file)
+    if args.metrics_port:
+        start_metrics_server(exporter, args.metrics_port, args.metrics_host)
+        logger.info(f"Serving metrics on http://{args.metrics_host}:{args.metrics_port}/metrics")
 
+    batch_bytes = max(1, args.batch_size) * 1024 * 1024
+    if args.transfer == 'pipe':
+        args.transport = spawn_local_receiver(args.replica, args.transfer_codec, batch_bytes)
+        logger.info(f"Transfer: local receiver, {args.transfer_codec} batches of {batch_bytes} bytes")
+    elif args.transfer:
+        try:
+            args.transport = connect_receiver(args.transfer, args.replica, args.transfer_codec, batch_bytes)
+        except (OSError, ValueError) as e:
+            raise SystemExit(f"Could not connect to the transfer receiver '{args.transfer}': {e}")
+        logger.info(f"Transfer: receiver at {args.transfer}, {args.transfer_codec} batches of {batch_bytes} bytes")
+    else:
+        args.transport = None
+
+    if args.watch and inotify_available():
+        # Only returns if watching had to be given up
+        watch_folders(args, logger, index, exporter)
+    elif args.watch:
+        logger.warning("inotify is not available, falling back to periodic full passes.")
+    # Fixed-rate schedule: passes start every interval, and slots missed by an overrun are skipped
+    next_pass = time.monotonic()
     while True:
-        changes_made = sync_folders(args.source, args.replica, logger)
-        if changes_made > 0:
-            logger.info(f"Synchronization completed successfully. {changes_made} changes made.")
-        else:
-            logger.info("No files changed.")
-        time.sleep(args.interval)
\ No newline at end of file
+        run_full_pass(args, logger, index, exporter)
+        next_pass, skipped = next_slot(next_pass, args.interval, time.monotonic())
+        if skipped:
+            logger.warning(f"Pass overran the interval, skipped {skipped} scheduled passes.")
+        time.sleep(max(0, next_pass - time.monotonic()))
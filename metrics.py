@@ -0,0 +1,189 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PHASES = ('scan', 'compare', 'copy', 'delete')
+COUNTERS = ('files_compared', 'files_copied', 'files_deleted', 'folders_created', 'bytes_hashed', 'bytes_copied', 'errors')
+
+class SyncMetrics:
+    """Thread-safe counters and phase timers for a single sync pass.
+
+    Phase times are summed over all workers, so with a thread pool they can add up
+    to more than the wall time of the pass.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.tier_decisions = {}
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    def add(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def add_time(self, phase, seconds):
+        with self._lock:
+            self.phase_seconds[phase] += seconds
+
+    @contextmanager
+    def phase(self, phase):
+        """Time the enclosed block as part of a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def record_tier(self, tier, equal):
+        """Count a comparison decided by a tier, by whether the files were found equal."""
+        result = 'equal' if equal else 'different'
+        with self._lock:
+            decisions = self.tier_decisions.setdefault(tier, {'equal': 0, 'different': 0})
+            decisions[result] += 1
+
+    def set_queue_depth(self, depth):
+        with self._lock:
+            self.queue_depth = depth
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def snapshot(self):
+        """Return a JSON-serializable copy of the metrics."""
+        with self._lock:
+            return {
+                'started': self.started,
+                'phase_seconds': dict(self.phase_seconds),
+                'counters': dict(self.counters),
+                'tier_decisions': {tier: dict(decisions) for tier, decisions in self.tier_decisions.items()},
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+            }
+
+def _labels(kind, pair):
+    return f'kind="{kind}"' + (f',pair="{pair}"' if pair is not None else '')
+
+class MetricsExporter:
+    """Accumulates finished passes and publishes them as JSON lines and Prometheus text.
+
+    Passes registered with start_pass are also published while they run, so a long
+    pass can be followed, and a stall spotted, before it finishes.
+    """
+
+    def __init__(self, stats_file=None):
+        self.stats_file = stats_file
+        self._lock = threading.Lock()
+        self._passes = {}
+        self._phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self._counters = dict.fromkeys(COUNTERS, 0)
+        self._tier_decisions = {}
+        self._last_pass = None
+        self._running = {}
+
+    def start_pass(self, kind, metrics, pair=None):
+        """Publish the live counters and queue depth of a pass until it is recorded."""
+        with self._lock:
+            self._running[id(metrics)] = (kind, pair, metrics)
+
+    def record_pass(self, kind, metrics, changes_made, pair=None):
+        """Add a finished pass to the totals and append it to the stats file."""
+        snapshot = metrics.snapshot()
+        snapshot.update({'kind': kind, 'changes_made': changes_made, 'duration': time.time() - snapshot['started']})
+        if pair is not None:
+            snapshot['pair'] = pair
+        with self._lock:
+            self._running.pop(id(metrics), None)
+            self._passes[kind] = self._passes.get(kind, 0) + 1
+            for phase, seconds in snapshot['phase_seconds'].items():
+                self._phase_seconds[phase] += seconds
+            for counter, value in snapshot['counters'].items():
+                self._counters[counter] += value
+            for tier, decisions in snapshot['tier_decisions'].items():
+                totals = self._tier_decisions.setdefault(tier, {'equal': 0, 'different': 0})
+                for result, count in decisions.items():
+                    totals[result] += count
+            self._last_pass = snapshot
+            if self.stats_file:
+                with open(self.stats_file, 'a') as f:
+                    f.write(json.dumps(snapshot) + '\n')
+        return snapshot
+
+    def render_prometheus(self):
+        """Return the totals in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                '# HELP folder_sync_passes_total Completed synchronization passes.',
+                '# TYPE folder_sync_passes_total counter',
+            ]
+            lines += [f'folder_sync_passes_total{{kind="{kind}"}} {count}' for kind, count in self._passes.items()]
+            lines += [
+                '# HELP folder_sync_phase_seconds_total Time spent in each phase, summed over workers.',
+                '# TYPE folder_sync_phase_seconds_total counter',
+            ]
+            lines += [f'folder_sync_phase_seconds_total{{phase="{phase}"}} {seconds}'
+                      for phase, seconds in self._phase_seconds.items()]
+            for counter, value in self._counters.items():
+                lines += [f'# TYPE folder_sync_{counter}_total counter', f'folder_sync_{counter}_total {value}']
+            lines += [
+                '# HELP folder_sync_compare_decisions_total Comparisons decided by each tier.',
+                '# TYPE folder_sync_compare_decisions_total counter',
+            ]
+            for tier, decisions in self._tier_decisions.items():
+                lines += [f'folder_sync_compare_decisions_total{{tier="{tier}",result="{result}"}} {count}'
+                          for result, count in decisions.items()]
+            if self._last_pass is not None:
+                lines += [
+                    '# TYPE folder_sync_last_pass_duration_seconds gauge',
+                    f'folder_sync_last_pass_duration_seconds {self._last_pass["duration"]}',
+                    '# TYPE folder_sync_last_pass_changes gauge',
+                    f'folder_sync_last_pass_changes {self._last_pass["changes_made"]}',
+                    '# TYPE folder_sync_last_pass_max_queue_depth gauge',
+                    f'folder_sync_last_pass_max_queue_depth {self._last_pass["max_queue_depth"]}',
+                    '# TYPE folder_sync_last_pass_timestamp_seconds gauge',
+                    f'folder_sync_last_pass_timestamp_seconds {self._last_pass["started"]}',
+                ]
+            running = [(_labels(kind, pair), metrics.snapshot()) for kind, pair, metrics in self._running.values()]
+        if running:
+            now = time.time()
+            lines += [
+                '# HELP folder_sync_current_pass_queue_depth Actions queued or deferred in a running pass.',
+                '# TYPE folder_sync_current_pass_queue_depth gauge',
+            ]
+            lines += [f'folder_sync_current_pass_queue_depth{{{labels}}} {snapshot["queue_depth"]}'
+                      for labels, snapshot in running]
+            lines.append('# TYPE folder_sync_current_pass_duration_seconds gauge')
+            lines += [f'folder_sync_current_pass_duration_seconds{{{labels}}} {now - snapshot["started"]}'
+                      for labels, snapshot in running]
+            for counter in COUNTERS:
+                lines.append(f'# TYPE folder_sync_current_pass_{counter} gauge')
+                lines += [f'folder_sync_current_pass_{counter}{{{labels}}} {snapshot["counters"][counter]}'
+                          for labels, snapshot in running]
+        return '\n'.join(lines) + '\n'
+
+def start_metrics_server(exporter, port, host='127.0.0.1'):
+    """Serve the exporter's Prometheus text on /metrics from a background thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = exporter.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes should not end up in the sync log
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
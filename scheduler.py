@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+def next_slot(due, interval, now):
+    """Advance a fixed-rate due time past now and return (next due time, number of slots skipped).
+
+    Slots are anchored to the original schedule, so passes do not drift, and slots
+    missed while a pass overran are skipped instead of being run back to back.
+    """
+    due += interval
+    skipped = 0
+    if due <= now:
+        skipped = int((now - due) // interval) + 1
+        due += skipped * interval
+    return due, skipped
+
+class TokenBucket:
+    """Rate limiter that lets callers go into debt and then waits it off."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount):
+        """Take amount tokens, sleeping as long as needed to stay under the rate."""
+        if not self.rate or amount <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+class ResourceBudget:
+    """Bandwidth and IOPS limits shared by every pair synced in this process.
+
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, bandwidth=0, iops=0):
+        self.bandwidth = TokenBucket(bandwidth)
+        self.iops = TokenBucket(iops)
+
+    def acquire(self, nbytes=0, operations=1):
+        self.iops.acquire(operations)
+        self.bandwidth.acquire(nbytes)
+
+class Job:
+    """A recurring pass with its own interval and priority."""
+
+    def __init__(self, name, interval, priority, run):
+        self.name = name
+        self.interval = interval
+        self.priority = priority
+        self.run = run
+        self.due = None
+        self.running = False
+        self.skipped = 0
+
+class Scheduler:
+    """Runs jobs at fixed rates, at most max_concurrent at a time, highest priority first."""
+
+    def __init__(self, jobs, max_concurrent, logger):
+        self.jobs = list(jobs)
+        self.max_concurrent = max(1, max_concurrent)
+        self.logger = logger
+        self._stopped = threading.Event()
+
+    def due_jobs(self, now):
+        """Return the idle jobs that are due, highest priority first and then longest waiting."""
+        due = [job for job in self.jobs if not job.running and job.due <= now]
+        return sorted(due, key=lambda job: (-job.priority, job.due))
+
+    def _reschedule(self, job, now):
+        job.due, skipped = next_slot(job.due, job.interval, now)
+        if skipped:
+            job.skipped += skipped
+            self.logger.warning(f"Pair '{job.name}' overran its interval, skipped {skipped} scheduled passes.")
+
+    def _run_job(self, job):
+        try:
+            job.run()
+        except Exception as e:
+            self.logger.error(f"Error during synchronization of pair '{job.name}': {e}")
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        """Run jobs until stop() is called."""
+        start = time.monotonic()
+        for job in self.jobs:
+            job.due = start
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            while not self._stopped.is_set():
+                now = time.monotonic()
+                for job in self.due_jobs(now)[:self.max_concurrent - len(running)]:
+                    job.running = True
+                    running[executor.submit(self._run_job, job)] = job
+
+                idle = [job.due for job in self.jobs if not job.running]
+                timeout = max(0, min(idle) - time.monotonic()) if idle else None
+                if len(running) >= self.max_concurrent:
+                    # Nothing else can start until a pass finishes
+                    timeout = None
+                if running:
+                    done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = running.pop(future)
+                        job.running = False
+                        self._reschedule(job, time.monotonic())
+                else:
+                    self._stopped.wait(timeout)
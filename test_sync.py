@@ -1,10 +1,27 @@
 import unittest
+import errno
+import hashlib
+import json
 from unittest.mock import patch, Mock
 import os
+import sys
 import tempfile
+import threading
+import time
+import urllib.request
 import shutil
 import logging
-from main import sync_folders, validate_paths, validate_interval
+from main import plan_sync, sync_folders, sync_paths, validate_paths, validate_interval, watch_folders
+from file_index import FileIndex
+from comparison import CompareStrategy, file_digest
+from file_operations import FsyncBatch, copy_file_atomic
+from delta_transfer import JOURNAL_COMMIT, JOURNAL_MAGIC, JOURNAL_RECORD, delta_copy, journal_path_for, recover_journal
+from metrics import MetricsExporter, SyncMetrics, start_metrics_server
+from scheduler import Job, ResourceBudget, Scheduler, TokenBucket, next_slot
+from daemon import load_config
+from benchmark import find_regressions, main as benchmark_main, measure_pass, peak_rss_bytes, reset_peak_rss, run_benchmark
+from watcher import InotifyWatcher, inotify_available, reduce_paths
+from transfer import Receiver, spawn_local_receiver
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -94,4 +111,1023 @@ class TestFolderSync(unittest.TestCase):
     def test_sync_folders_network_error(self, mock_copy):
         logger.info("Running test_sync_folders_network_error")
         mock_copy.side_effect = IOError("Network error")
-        
+
+
+class TestFileIndex(unittest.TestCase):
+
+    def setUp(self):
+        logger.info(f"Setting up test: {self._testMethodName}")
+        self.source_dir = tempfile.mkdtemp()
+        self.replica_dir = tempfile.mkdtemp()
+        self.log_dir = tempfile.mkdtemp()
+        self.index = FileIndex(self.log_dir)
+
+    def tearDown(self):
+        logger.info(f"Tearing down test: {self._testMethodName}")
+        self.index.close()
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.replica_dir)
+        shutil.rmtree(self.log_dir)
+
+    def test_unchanged_files_are_not_rehashed(self):
+        logger.info("Running test_unchanged_files_are_not_rehashed")
+        with open(os.path.join(self.source_dir, 'test_file.txt'), 'w') as f:
+            f.write('content')
+
+        sync_folders(self.source_dir, self.replica_dir, Mock(), self.index)
+        sync_folders(self.source_dir, self.replica_dir, Mock(), self.index)
+
+        with patch('file_index.file_digest') as mock_digest:
+            changes_made = sync_folders(self.source_dir, self.replica_dir, Mock(), self.index)
+            mock_digest.assert_not_called()
+        self.assertEqual(changes_made, 0)
+        logger.info("test_unchanged_files_are_not_rehashed passed")
+
+    def test_no_op_pass_stats_each_file_once(self):
+        logger.info("Running test_no_op_pass_stats_each_file_once")
+        for i in range(5):
+            with open(os.path.join(self.source_dir, f'file{i}.txt'), 'w') as f:
+                f.write(f'content {i}')
+        sync_folders(self.source_dir, self.replica_dir, Mock(), self.index, compare='safe')
+        sync_folders(self.source_dir, self.replica_dir, Mock(), self.index, compare='safe')
+
+        with patch('os.stat', wraps=os.stat) as mock_stat:
+            changes_made = sync_folders(self.source_dir, self.replica_dir, Mock(), self.index, compare='safe')
+        self.assertEqual(changes_made, 0)
+        # One stat per source file and one per replica file
+        self.assertEqual(mock_stat.call_count, 10)
+        logger.info("test_no_op_pass_stats_each_file_once passed")
+
+    def test_verify_sample_detects_bit_rot(self):
+        logger.info("Running test_verify_sample_detects_bit_rot")
+        file_path = os.path.join(self.replica_dir, 'test_file.txt')
+        with open(file_path, 'w') as f:
+            f.write('content')
+        self.index.get_md5(file_path)
+
+        # Corrupt the content but restore the original mtime so the stat tuple still matches
+        st = os.stat(file_path)
+        with open(file_path, 'r+') as f:
+            f.write('CONTENT')
+        os.utime(file_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        sync_logger = Mock()
+        self.assertEqual(self.index.verify_sample(10, sync_logger), [os.path.abspath(file_path)])
+        sync_logger.warning.assert_called()
+        logger.info("test_verify_sample_detects_bit_rot passed")
+
+    def test_verify_sample_hashes_only_the_sample(self):
+        logger.info("Running test_verify_sample_hashes_only_the_sample")
+        for i in range(20):
+            file_path = os.path.join(self.replica_dir, f'file{i}.txt')
+            with open(file_path, 'w') as f:
+                f.write(f'content {i}')
+            self.index.get_md5(file_path)
+
+        with patch('file_index.file_digest', side_effect=file_digest) as mock_digest:
+            self.assertEqual(self.index.verify_sample(3, Mock()), [])
+        self.assertEqual(mock_digest.call_count, 3)
+        logger.info("test_verify_sample_hashes_only_the_sample passed")
+
+    def test_deleted_source_files_are_dropped_from_index(self):
+        logger.info("Running test_deleted_source_files_are_dropped_from_index")
+        file_path = os.path.join(self.source_dir, 'test_file.txt')
+        with open(file_path, 'w') as f:
+            f.write('content')
+        sync_folders(self.source_dir, self.replica_dir, Mock(), self.index)
+        sync_folders(self.source_dir, self.replica_dir, Mock(), self.index)
+
+        os.remove(file_path)
+        sync_folders(self.source_dir, self.replica_dir, Mock(), self.index)
+
+        self.assertEqual(self.index._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0], 0)
+        logger.info("test_deleted_source_files_are_dropped_from_index passed")
+
+
+class TestParallelSync(unittest.TestCase):
+
+    def setUp(self):
+        logger.info(f"Setting up test: {self._testMethodName}")
+        self.source_dir = tempfile.mkdtemp()
+        self.replica_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logger.info(f"Tearing down test: {self._testMethodName}")
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.replica_dir)
+
+    def test_parallel_sync_matches_source(self):
+        logger.info("Running test_parallel_sync_matches_source")
+        for folder in ('a', os.path.join('a', 'b'), 'c'):
+            os.makedirs(os.path.join(self.source_dir, folder), exist_ok=True)
+            for i in range(5):
+                with open(os.path.join(self.source_dir, folder, f'file_{i}.txt'), 'w') as f:
+                    f.write(f'{folder} {i}')
+        open(os.path.join(self.replica_dir, 'stale.txt'), 'w').close()
+
+        changes_made = sync_folders(self.source_dir, self.replica_dir, Mock(), workers=4)
+
+        # 3 folders created, 15 files copied, 1 stale file removed
+        self.assertEqual(changes_made, 19)
+        self.assertFalse(os.path.exists(os.path.join(self.replica_dir, 'stale.txt')))
+        with open(os.path.join(self.replica_dir, 'a', 'b', 'file_3.txt')) as f:
+            self.assertEqual(f.read(), f"{os.path.join('a', 'b')} 3")
+        self.assertEqual(sync_folders(self.source_dir, self.replica_dir, Mock(), workers=4), 0)
+        logger.info("test_parallel_sync_matches_source passed")
+
+    @patch('main.copy_files_and_directories')
+    def test_parallel_sync_logs_worker_errors(self, mock_copy):
+        logger.info("Running test_parallel_sync_logs_worker_errors")
+        mock_copy.side_effect = PermissionError("Permission denied")
+        open(os.path.join(self.source_dir, 'test_file.txt'), 'w').close()
+
+        sync_logger = Mock()
+        sync_folders(self.source_dir, self.replica_dir, sync_logger, workers=4)
+
+        sync_logger.error.assert_called_with("Permission error: Permission denied")
+        logger.info("test_parallel_sync_logs_worker_errors passed")
+
+
+class TestWatchSync(unittest.TestCase):
+
+    def setUp(self):
+        logger.info(f"Setting up test: {self._testMethodName}")
+        self.source_dir = tempfile.mkdtemp()
+        self.replica_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logger.info(f"Tearing down test: {self._testMethodName}")
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.replica_dir)
+
+    def test_reduce_paths(self):
+        logger.info("Running test_reduce_paths")
+        paths = ['a', os.path.join('a', 'x'), 'a b', os.path.join('c', 'd')]
+        self.assertEqual(reduce_paths(paths), ['a', 'a b', os.path.join('c', 'd')])
+        self.assertEqual(reduce_paths(['', 'a']), [''])
+        logger.info("test_reduce_paths passed")
+
+    def test_sync_paths_only_touches_given_paths(self):
+        logger.info("Running test_sync_paths_only_touches_given_paths")
+        os.makedirs(os.path.join(self.source_dir, 'new', 'deep'))
+        open(os.path.join(self.source_dir, 'new', 'deep', 'file.txt'), 'w').close()
+        open(os.path.join(self.source_dir, 'untouched.txt'), 'w').close()
+        open(os.path.join(self.replica_dir, 'removed.txt'), 'w').close()
+
+        # A change deep inside a folder missing from the replica syncs the whole folder
+        changes_made = sync_paths(self.source_dir, self.replica_dir,
+                                  [os.path.join('new', 'deep', 'file.txt'), 'removed.txt'], Mock())
+
+        self.assertEqual(changes_made, 4)
+        self.assertTrue(os.path.exists(os.path.join(self.replica_dir, 'new', 'deep', 'file.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.replica_dir, 'removed.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.replica_dir, 'untouched.txt')))
+        logger.info("test_sync_paths_only_touches_given_paths passed")
+
+    def test_sync_paths_replaces_type_changes(self):
+        logger.info("Running test_sync_paths_replaces_type_changes")
+        os.makedirs(os.path.join(self.source_dir, 'a'))
+        open(os.path.join(self.source_dir, 'a', 'x'), 'w').close()
+        open(os.path.join(self.replica_dir, 'a'), 'w').close()
+        open(os.path.join(self.source_dir, 'b'), 'w').close()
+        os.makedirs(os.path.join(self.replica_dir, 'b', 'inner'))
+
+        sync_logger = Mock()
+        changes_made = sync_paths(self.source_dir, self.replica_dir, [os.path.join('a', 'x'), 'b'], sync_logger)
+
+        sync_logger.error.assert_not_called()
+        self.assertEqual(changes_made, 5)
+        self.assertTrue(os.path.isfile(os.path.join(self.replica_dir, 'a', 'x')))
+        self.assertTrue(os.path.isfile(os.path.join(self.replica_dir, 'b')))
+        logger.info("test_sync_paths_replaces_type_changes passed")
+
+    @unittest.skipUnless(inotify_available(), "inotify is not available")
+    def test_watcher_reports_changes(self):
+        logger.info("Running test_watcher_reports_changes")
+        os.makedirs(os.path.join(self.source_dir, 'sub'))
+        watcher = InotifyWatcher(self.source_dir)
+        try:
+            os.makedirs(os.path.join(self.source_dir, 'created'))
+            with open(os.path.join(self.source_dir, 'sub', 'file.txt'), 'w') as f:
+                f.write('content')
+            rel_paths, overflowed = watcher.collect_changes(1, 0.05)
+
+            # Folders created after the watch started are watched as well
+            open(os.path.join(self.source_dir, 'created', 'inner.txt'), 'w').close()
+            inner_paths, _ = watcher.collect_changes(1, 0.05)
+        finally:
+            watcher.close()
+
+        self.assertFalse(overflowed)
+        self.assertEqual(rel_paths, ['created', os.path.join('sub', 'file.txt')])
+        self.assertEqual(inner_paths, [os.path.join('created', 'inner.txt')])
+        logger.info("test_watcher_reports_changes passed")
+
+    @unittest.skipUnless(inotify_available(), "inotify is not available")
+    def test_watcher_skips_unreadable_folders(self):
+        logger.info("Running test_watcher_skips_unreadable_folders")
+        for name in ('locked', 'open'):
+            os.makedirs(os.path.join(self.source_dir, name, 'inner'))
+        locked = os.path.join(self.source_dir, 'locked')
+        real_scandir = os.scandir
+
+        def scandir(path):
+            if path == locked:
+                raise PermissionError(errno.EACCES, "Permission denied", path)
+            return real_scandir(path)
+
+        watch_logger = Mock()
+        with patch('watcher.os.scandir', side_effect=scandir):
+            watcher = InotifyWatcher(self.source_dir, watch_logger)
+        try:
+            open(os.path.join(self.source_dir, 'open', 'inner', 'file.txt'), 'w').close()
+            rel_paths, _ = watcher.collect_changes(1, 0.05)
+        finally:
+            watcher.close()
+
+        watch_logger.warning.assert_called_once()
+        self.assertEqual(rel_paths, [os.path.join('open', 'inner', 'file.txt')])
+        logger.info("test_watcher_skips_unreadable_folders passed")
+
+    @unittest.skipUnless(inotify_available(), "inotify is not available")
+    def test_watch_limit_falls_back_to_full_passes(self):
+        logger.info("Running test_watch_limit_falls_back_to_full_passes")
+        os.makedirs(os.path.join(self.source_dir, 'sub'))
+        watcher = InotifyWatcher(self.source_dir)
+        try:
+            # Pretend the watch limit is reached when a new folder appears
+            watcher._libc = Mock(inotify_add_watch=Mock(return_value=-1))
+            os.makedirs(os.path.join(self.source_dir, 'new'))
+            with patch('watcher.ctypes.get_errno', return_value=errno.ENOSPC):
+                with self.assertRaises(OSError) as raised:
+                    watcher.collect_changes(1, 0.05)
+        finally:
+            watcher.close()
+        self.assertEqual(raised.exception.errno, errno.ENOSPC)
+
+        args = Mock(source=self.source_dir)
+        watch_logger = Mock()
+        with patch('main.InotifyWatcher', side_effect=OSError(errno.ENOSPC, "No space left on device")), \
+                patch('main.run_full_pass') as mock_full_pass:
+            watch_folders(args, watch_logger, None, None)
+        mock_full_pass.assert_not_called()
+        watch_logger.warning.assert_called_once()
+        logger.info("test_watch_limit_falls_back_to_full_passes passed")
+
+
+class TestDeltaTransfer(unittest.TestCase):
+
+    def setUp(self):
+        logger.info(f"Setting up test: {self._testMethodName}")
+        self.work_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.work_dir, 'source.img')
+        self.replica = os.path.join(self.work_dir, 'replica.img')
+        self.original = os.urandom(10 * 4096)
+        with open(self.replica, 'wb') as f:
+            f.write(self.original)
+
+    def tearDown(self):
+        logger.info(f"Tearing down test: {self._testMethodName}")
+        shutil.rmtree(self.work_dir)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_delta_copy_rewrites_only_changed_blocks(self):
+        logger.info("Running test_delta_copy_rewrites_only_changed_blocks")
+        changed = bytearray(self.original)
+        changed[5 * 4096 + 10] ^= 0xFF
+        with open(self.source, 'wb') as f:
+            f.write(changed + b'tail')
+
+        bytes_changed = delta_copy(self.source, self.replica, block_size=4096)
+
+        self.assertEqual(bytes_changed, 4096 + 4)
+        self.assertEqual(self.read(self.replica), self.read(self.source))
+        self.assertFalse(os.path.exists(journal_path_for(self.replica)))
+        logger.info("test_delta_copy_rewrites_only_changed_blocks passed")
+
+    def test_delta_copy_updates_read_only_replica(self):
+        logger.info("Running test_delta_copy_updates_read_only_replica")
+        changed = bytearray(self.original)
+        changed[0] ^= 0xFF
+        with open(self.source, 'wb') as f:
+            f.write(changed)
+        os.chmod(self.source, 0o444)
+        os.chmod(self.replica, 0o444)
+
+        self.assertEqual(delta_copy(self.source, self.replica, block_size=4096), 4096)
+        self.assertEqual(self.read(self.replica), bytes(changed))
+        self.assertEqual(os.stat(self.replica).st_mode & 0o777, 0o444)
+        logger.info("test_delta_copy_updates_read_only_replica passed")
+
+    def test_failed_delta_falls_back_to_full_copy(self):
+        logger.info("Running test_failed_delta_falls_back_to_full_copy")
+        source_dir = os.path.join(self.work_dir, 'source')
+        replica_dir = os.path.join(self.work_dir, 'replica')
+        os.makedirs(source_dir)
+        os.makedirs(replica_dir)
+        with open(os.path.join(source_dir, 'disk.img'), 'wb') as f:
+            f.write(b'new' + self.original)
+        shutil.copy(self.replica, os.path.join(replica_dir, 'disk.img'))
+
+        sync_logger = Mock()
+        with patch('main.delta_copy', side_effect=PermissionError("Permission denied")):
+            changes_made = sync_folders(source_dir, replica_dir, sync_logger, delta_threshold=1)
+
+        self.assertEqual(changes_made, 1)
+        self.assertEqual(self.read(os.path.join(replica_dir, 'disk.img')), b'new' + self.original)
+        sync_logger.warning.assert_called_once()
+        sync_logger.error.assert_not_called()
+        logger.info("test_failed_delta_falls_back_to_full_copy passed")
+
+    def test_delta_copy_truncates_shorter_source(self):
+        logger.info("Running test_delta_copy_truncates_shorter_source")
+        with open(self.source, 'wb') as f:
+            f.write(self.original[:3 * 4096])
+
+        self.assertEqual(delta_copy(self.source, self.replica, block_size=4096), 0)
+        self.assertEqual(self.read(self.replica), self.original[:3 * 4096])
+        logger.info("test_delta_copy_truncates_shorter_source passed")
+
+    def test_incomplete_journal_is_discarded(self):
+        logger.info("Running test_incomplete_journal_is_discarded")
+        # Simulate a crash while the journal was being written: no commit record
+        with open(journal_path_for(self.replica), 'wb') as f:
+            f.write(JOURNAL_MAGIC + JOURNAL_RECORD.pack(0, 4) + b'XXXX')
+
+        self.assertFalse(recover_journal(self.replica))
+        self.assertEqual(self.read(self.replica), self.original)
+        self.assertFalse(os.path.exists(journal_path_for(self.replica)))
+        logger.info("test_incomplete_journal_is_discarded passed")
+
+    def test_committed_journal_is_replayed(self):
+        logger.info("Running test_committed_journal_is_replayed")
+        # Simulate a crash after the journal was committed but before it was applied
+        with open(journal_path_for(self.replica), 'wb') as f:
+            f.write(JOURNAL_MAGIC + JOURNAL_RECORD.pack(0, 4) + b'XXXX')
+            f.write(JOURNAL_RECORD.pack(JOURNAL_COMMIT, 8))
+
+        self.assertTrue(recover_journal(self.replica))
+        self.assertEqual(self.read(self.replica), b'XXXX' + self.original[4:8])
+        logger.info("test_committed_journal_is_replayed passed")
+
+
+class TestTreeDiff(unittest.TestCase):
+
+    def setUp(self):
+        logger.info(f"Setting up test: {self._testMethodName}")
+        self.source_dir = tempfile.mkdtemp()
+        self.replica_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logger.info(f"Tearing down test: {self._testMethodName}")
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.replica_dir)
+
+    def test_plan_sync_is_lazy(self):
+        logger.info("Running test_plan_sync_is_lazy")
+        for i in range(10):
+            open(os.path.join(self.source_dir, f'file_{i}.txt'), 'w').close()
+
+        actions = plan_sync(self.source_dir, self.replica_dir)
+        self.assertEqual(next(actions).kind, 'copy')
+        actions.close()
+        logger.info("test_plan_sync_is_lazy passed")
+
+    def test_unreadable_folder_does_not_stop_siblings(self):
+        logger.info("Running test_unreadable_folder_does_not_stop_siblings")
+        for name in 'abcdef':
+            os.makedirs(os.path.join(self.source_dir, name))
+            with open(os.path.join(self.source_dir, name, 'file.txt'), 'w') as f:
+                f.write(name)
+        # A replica file the unreadable source folder cannot vouch for must survive
+        os.makedirs(os.path.join(self.replica_dir, 'c'))
+        open(os.path.join(self.replica_dir, 'c', 'keep.txt'), 'w').close()
+
+        unreadable = os.path.join(self.source_dir, 'c')
+        real_scandir = os.scandir
+
+        def scandir(path):
+            if path == unreadable:
+                raise PermissionError(errno.EACCES, "Permission denied", path)
+            return real_scandir(path)
+
+        sync_logger = Mock()
+        with patch('main.os.scandir', side_effect=scandir):
+            sync_folders(self.source_dir, self.replica_dir, sync_logger)
+
+        for name in 'abdef':
+            self.assertTrue(os.path.isfile(os.path.join(self.replica_dir, name, 'file.txt')))
+        self.assertEqual(os.listdir(os.path.join(self.replica_dir, 'c')), ['keep.txt'])
+        sync_logger.error.assert_called_once()
+        logger.info("test_unreadable_folder_does_not_stop_siblings passed")
+
+    def test_type_mismatch_is_replaced(self):
+        logger.info("Running test_type_mismatch_is_replaced")
+        os.makedirs(os.path.join(self.source_dir, 'was_file'))
+        open(os.path.join(self.source_dir, 'was_folder'), 'w').close()
+        open(os.path.join(self.replica_dir, 'was_file'), 'w').close()
+        os.makedirs(os.path.join(self.replica_dir, 'was_folder'))
+
+        sync_folders(self.source_dir, self.replica_dir, Mock())
+
+        self.assertTrue(os.path.isdir(os.path.join(self.replica_dir, 'was_file')))
+        self.assertTrue(os.path.isfile(os.path.join(self.replica_dir, 'was_folder')))
+        logger.info("test_type_mismatch_is_replaced passed")
+
+    def test_depth_beyond_recursion_limit(self):
+        logger.info("Running test_depth_beyond_recursion_limit")
+        depth = 300
+        deepest = self.source_dir
+        for _ in range(depth):
+            deepest = os.path.join(deepest, 'd')
+            os.mkdir(deepest)
+        open(os.path.join(deepest, 'leaf.txt'), 'w').close()
+
+        sync_logger = Mock()
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(200)
+        try:
+            changes_made = sync_folders(self.source_dir, self.replica_dir, sync_logger)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
+        sync_logger.error.assert_not_called()
+        self.assertEqual(changes_made, depth + 1)
+        self.assertTrue(os.path.exists(os.path.join(self.replica_dir, *(['d'] * depth), 'leaf.txt')))
+        logger.info("test_depth_beyond_recursion_limit passed")
+
+
+class TestCompareStrategy(unittest.TestCase):
+
+    def setUp(self):
+        logger.info(f"Setting up test: {self._testMethodName}")
+        self.work_dir = tempfile.mkdtemp()
+        self.file1 = os.path.join(self.work_dir, 'file1.bin')
+        self.file2 = os.path.join(self.work_dir, 'file2.bin')
+
+    def tearDown(self):
+        logger.info(f"Tearing down test: {self._testMethodName}")
+        shutil.rmtree(self.work_dir)
+
+    def write(self, path, data, mtime_ns=None):
+        with open(path, 'wb') as f:
+            f.write(data)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_size_difference_short_circuits(self):
+        logger.info("Running test_size_difference_short_circuits")
+        self.write(self.file1, b'a' * 10)
+        self.write(self.file2, b'a' * 11)
+        strategy = CompareStrategy.from_spec('fast')
+
+        with patch('comparison.file_digest') as mock_digest:
+            self.assertEqual(strategy.compare(self.file1, self.file2), (False, 'size'))
+            mock_digest.assert_not_called()
+        logger.info("test_size_difference_short_circuits passed")
+
+    def test_matching_mtime_skips_content_read(self):
+        logger.info("Running test_matching_mtime_skips_content_read")
+        self.write(self.file1, b'abc', mtime_ns=10 ** 18)
+        self.write(self.file2, b'abd', mtime_ns=10 ** 18)
+
+        self.assertEqual(CompareStrategy.from_spec('fast').compare(self.file1, self.file2), (True, 'mtime'))
+        self.assertEqual(CompareStrategy.from_spec('safe').compare(self.file1, self.file2), (False, 'partial'))
+        logger.info("test_matching_mtime_skips_content_read passed")
+
+    def test_full_hash_decides_middle_difference(self):
+        logger.info("Running test_full_hash_decides_middle_difference")
+        data = bytearray(os.urandom(512 * 1024))
+        self.write(self.file1, data, mtime_ns=10 ** 18)
+        data[256 * 1024] ^= 0xFF
+        self.write(self.file2, data, mtime_ns=2 * 10 ** 18)
+
+        strategy = CompareStrategy.from_spec('size,mtime,partial,full', 'blake2b')
+        self.assertEqual(strategy.compare(self.file1, self.file2), (False, 'full'))
+        logger.info("test_full_hash_decides_middle_difference passed")
+
+    def test_safe_no_op_pass_with_index_opens_no_files(self):
+        logger.info("Running test_safe_no_op_pass_with_index_opens_no_files")
+        source_dir = os.path.join(self.work_dir, 'source')
+        replica_dir = os.path.join(self.work_dir, 'replica')
+        os.makedirs(source_dir)
+        os.makedirs(replica_dir)
+        for i in range(5):
+            self.write(os.path.join(source_dir, f'file{i}.bin'), os.urandom(200 * 1024))
+        index = FileIndex(self.work_dir)
+        try:
+            sync_folders(source_dir, replica_dir, Mock(), index, compare='safe')
+            sync_folders(source_dir, replica_dir, Mock(), index, compare='safe')
+
+            metrics = SyncMetrics()
+            with patch('builtins.open', wraps=open) as mock_open:
+                changes_made = sync_folders(source_dir, replica_dir, Mock(), index, compare='safe', metrics=metrics)
+                mock_open.assert_not_called()
+        finally:
+            index.close()
+
+        self.assertEqual(changes_made, 0)
+        self.assertEqual(metrics.counters['bytes_hashed'], 0)
+        self.assertEqual(metrics.tier_decisions, {'full': {'equal': 5, 'different': 0}})
+        logger.info("test_safe_no_op_pass_with_index_opens_no_files passed")
+
+    def test_invalid_spec_and_digest(self):
+        logger.info("Running test_invalid_spec_and_digest")
+        with self.assertRaises(ValueError):
+            CompareStrategy.from_spec('size,ctime')
+        with self.assertRaises(ValueError):
+            CompareStrategy.from_spec('full', 'crc0')
+        logger.info("test_invalid_spec_and_digest passed")
+
+    def test_file_digest_matches_hashlib(self):
+        logger.info("Running test_file_digest_matches_hashlib")
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        self.write(self.file1, data)
+        self.assertEqual(file_digest(self.file1, 'sha256'), hashlib.sha256(data).hexdigest())
+        logger.info("test_file_digest_matches_hashlib passed")
+
+
+class TestAtomicCopy(unittest.TestCase):
+
+    def setUp(self):
+        logger.info(f"Setting up test: {self._testMethodName}")
+        self.work_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.work_dir, 'source.bin')
+        self.dest = os.path.join(self.work_dir, 'dest.bin')
+        self.data = os.urandom(256 * 1024)
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+        os.utime(self.source, ns=(10 ** 18, 10 ** 18))
+
+    def tearDown(self):
+        logger.info(f"Tearing down test: {self._testMethodName}")
+        shutil.rmtree(self.work_dir)
+
+    def assert_copied(self):
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.stat(self.dest).st_mtime_ns, 10 ** 18)
+        self.assertEqual(sorted(os.listdir(self.work_dir)), ['dest.bin', 'source.bin'])
+
+    def test_copy_replaces_existing_file(self):
+        logger.info("Running test_copy_replaces_existing_file")
+        with open(self.dest, 'wb') as f:
+            f.write(b'old content')
+
+        copy_file_atomic(self.source, self.dest, fsync=True)
+
+        self.assert_copied()
+        logger.info("test_copy_replaces_existing_file passed")
+
+    @patch('file_operations.fcntl', None)
+    def test_copy_falls_back_when_fast_paths_unsupported(self):
+        logger.info("Running test_copy_falls_back_when_fast_paths_unsupported")
+        unsupported = OSError(errno.EXDEV, "Invalid cross-device link")
+        with patch('os.copy_file_range', side_effect=unsupported, create=True), \
+                patch('os.sendfile', side_effect=unsupported, create=True):
+            copy_file_atomic(self.source, self.dest)
+
+        self.assert_copied()
+        logger.info("test_copy_falls_back_when_fast_paths_unsupported passed")
+
+    def test_failed_copy_leaves_destination_untouched(self):
+        logger.info("Running test_failed_copy_leaves_destination_untouched")
+        with open(self.dest, 'wb') as f:
+            f.write(b'old content')
+
+        with patch('file_operations.copy_file_contents', side_effect=OSError(errno.EIO, "I/O error")):
+            with self.assertRaises(OSError):
+                copy_file_atomic(self.source, self.dest)
+
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), b'old content')
+        self.assertEqual(sorted(os.listdir(self.work_dir)), ['dest.bin', 'source.bin'])
+        logger.info("test_failed_copy_leaves_destination_untouched passed")
+
+    def test_fsync_batch_flushes_after_pass(self):
+        logger.info("Running test_fsync_batch_flushes_after_pass")
+        batch = FsyncBatch()
+        copy_file_atomic(self.source, self.dest, fsync=batch)
+
+        with patch('file_operations.fsync_path') as mock_fsync:
+            batch.flush()
+        mock_fsync.assert_any_call(self.dest)
+        mock_fsync.assert_any_call(self.work_dir)
+        self.assert_copied()
+        logger.info("test_fsync_batch_flushes_after_pass passed")
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_benchmark_passes_and_regression_check(self):
+        logger.info("Running test_benchmark_passes_and_regression_check")
+        results = run_benchmark('small-files', scale=0.05, mutate_percent=20, workers=2)
+
+        self.assertEqual(results['files'], 105)
+        self.assertEqual(results['passes']['noop']['changes_made'], 0)
+        self.assertGreater(results['passes']['incremental']['changes_made'], 0)
+
+        current = {'profiles': {'small-files': results}}
+        slower = json.loads(json.dumps(current))
+        slower['profiles']['small-files']['passes']['full']['wall_time'] *= 2
+        self.assertEqual(find_regressions(current, current, 10), [])
+        self.assertEqual(len(find_regressions(slower, current, 10)), 1)
+        logger.info("test_benchmark_passes_and_regression_check passed")
+
+    def test_baseline_with_other_settings_is_refused(self):
+        logger.info("Running test_baseline_with_other_settings_is_refused")
+        work_dir = tempfile.mkdtemp()
+        try:
+            baseline_path = os.path.join(work_dir, 'baseline.json')
+            args = ['-p', 'wide', '--scale', '0.01', '--work-dir', work_dir]
+            with patch('builtins.print'):
+                self.assertEqual(benchmark_main(args + ['-o', baseline_path]), 0)
+                self.assertIn(benchmark_main(args + ['--baseline', baseline_path, '--threshold', '1000']), (0, 1))
+                with patch('builtins.print') as mock_print:
+                    self.assertEqual(benchmark_main(args + ['--index', '--baseline', baseline_path]), 2)
+        finally:
+            shutil.rmtree(work_dir)
+        mock_print.assert_any_call("Baseline settings differ: index: False -> True")
+        logger.info("test_baseline_with_other_settings_is_refused passed")
+
+    def test_huge_files_profile_is_mutated(self):
+        logger.info("Running test_huge_files_profile_is_mutated")
+        results = run_benchmark('huge-files', scale=0.1, delta_threshold=1)
+
+        self.assertEqual(results['files'], 1)
+        self.assertGreater(results['mutations'], 0)
+        self.assertGreater(results['passes']['incremental']['changes_made'], 0)
+        logger.info("test_huge_files_profile_is_mutated passed")
+
+    @unittest.skipUnless(reset_peak_rss(), "peak RSS cannot be reset on this platform")
+    def test_peak_rss_covers_only_the_pass(self):
+        logger.info("Running test_peak_rss_covers_only_the_pass")
+        work_dir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(work_dir, 'source'))
+            os.makedirs(os.path.join(work_dir, 'replica'))
+            open(os.path.join(work_dir, 'source', 'file.txt'), 'w').close()
+            reset_peak_rss()
+            ballast = b'x' * (256 * 1024 * 1024)
+            earlier_peak = peak_rss_bytes()
+            del ballast
+
+            measurement = measure_pass(os.path.join(work_dir, 'source'), os.path.join(work_dir, 'replica'), 1, 0, Mock())
+        finally:
+            shutil.rmtree(work_dir)
+        self.assertLess(measurement['peak_rss'], earlier_peak - 128 * 1024 * 1024)
+        logger.info("test_peak_rss_covers_only_the_pass passed")
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        logger.info(f"Setting up test: {self._testMethodName}")
+        self.source_dir = tempfile.mkdtemp()
+        self.replica_dir = tempfile.mkdtemp()
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logger.info(f"Tearing down test: {self._testMethodName}")
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.replica_dir)
+        shutil.rmtree(self.log_dir)
+
+    def test_pass_metrics_are_collected(self):
+        logger.info("Running test_pass_metrics_are_collected")
+        for name, source_data, replica_data in (('same.txt', b'abc', b'abc'), ('resized.txt', b'abcd', b'abc')):
+            with open(os.path.join(self.source_dir, name), 'wb') as f:
+                f.write(source_data)
+            with open(os.path.join(self.replica_dir, name), 'wb') as f:
+                f.write(replica_data)
+        open(os.path.join(self.replica_dir, 'stale.txt'), 'w').close()
+
+        metrics = SyncMetrics()
+        sync_folders(self.source_dir, self.replica_dir, Mock(), compare='safe', metrics=metrics)
+        snapshot = metrics.snapshot()
+
+        self.assertEqual(snapshot['counters']['files_compared'], 2)
+        self.assertEqual(snapshot['counters']['files_copied'], 1)
+        self.assertEqual(snapshot['counters']['files_deleted'], 1)
+        self.assertEqual(snapshot['counters']['bytes_copied'], 4)
+        self.assertEqual(snapshot['tier_decisions']['size'], {'equal': 0, 'different': 1})
+        self.assertEqual(snapshot['tier_decisions']['full'], {'equal': 1, 'different': 0})
+        self.assertGreater(snapshot['phase_seconds']['scan'], 0)
+        logger.info("test_pass_metrics_are_collected passed")
+
+    def test_exporter_writes_json_lines_and_serves_prometheus(self):
+        logger.info("Running test_exporter_writes_json_lines_and_serves_prometheus")
+        stats_file = os.path.join(self.log_dir, 'stats.jsonl')
+        exporter = MetricsExporter(stats_file)
+        for _ in range(2):
+            metrics = SyncMetrics()
+            metrics.add('bytes_copied', 10)
+            exporter.record_pass('full', metrics, 1)
+
+        with open(stats_file) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['counters']['bytes_copied'], 10)
+
+        server = start_metrics_server(exporter, 0)
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+                body = response.read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('folder_sync_passes_total{kind="full"} 2', body)
+        self.assertIn('folder_sync_bytes_copied_total 20', body)
+        logger.info("test_exporter_writes_json_lines_and_serves_prometheus passed")
+
+    def test_queue_depth_follows_drained_actions_and_deletions(self):
+        logger.info("Running test_queue_depth_follows_drained_actions_and_deletions")
+        for i in range(3):
+            open(os.path.join(self.replica_dir, f'stale{i}.txt'), 'w').close()
+        for i in range(20):
+            open(os.path.join(self.source_dir, f'file{i}.txt'), 'w').close()
+
+        for workers in (1, 2):
+            metrics = SyncMetrics()
+            depths = []
+            set_queue_depth = metrics.set_queue_depth
+            metrics.set_queue_depth = lambda depth: (depths.append(depth), set_queue_depth(depth))
+            sync_folders(self.source_dir, self.replica_dir, Mock(), workers=workers, metrics=metrics)
+            if workers == 1:
+                self.assertEqual(depths, [1, 2, 3, 2, 1, 0, 0])
+            else:
+                # The queue shrinks as actions finish, not only when the pass ends
+                self.assertTrue(any(later < earlier for earlier, later in zip(depths, depths[1:-1])))
+            self.assertEqual(metrics.snapshot()['queue_depth'], 0)
+            shutil.rmtree(self.replica_dir)
+            os.makedirs(self.replica_dir)
+        logger.info("test_queue_depth_follows_drained_actions_and_deletions passed")
+
+    def test_running_pass_is_exported(self):
+        logger.info("Running test_running_pass_is_exported")
+        exporter = MetricsExporter()
+        metrics = SyncMetrics()
+        exporter.start_pass('full', metrics, 'photos')
+        metrics.add('files_copied', 3)
+        metrics.set_queue_depth(7)
+
+        body = exporter.render_prometheus()
+        self.assertIn('folder_sync_current_pass_queue_depth{kind="full",pair="photos"} 7', body)
+        self.assertIn('folder_sync_current_pass_files_copied{kind="full",pair="photos"} 3', body)
+
+        exporter.record_pass('full', metrics, 3, 'photos')
+        self.assertNotIn('folder_sync_current_pass', exporter.render_prometheus())
+        logger.info("test_running_pass_is_exported passed")
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_next_slot_keeps_fixed_rate_and_skips_overruns(self):
+        logger.info("Running test_next_slot_keeps_fixed_rate_and_skips_overruns")
+        self.assertEqual(next_slot(100, 10, 103), (110, 0))
+        # A pass that ran until 125 misses the slots at 110 and 120
+        self.assertEqual(next_slot(100, 10, 125), (130, 2))
+        self.assertEqual(next_slot(100, 10, 120), (130, 2))
+        logger.info("test_next_slot_keeps_fixed_rate_and_skips_overruns passed")
+
+    def test_due_jobs_are_ordered_by_priority(self):
+        logger.info("Running test_due_jobs_are_ordered_by_priority")
+        low, high, busy, later = (Job('low', 10, 1, None), Job('high', 10, 5, None),
+                                  Job('busy', 10, 9, None), Job('later', 10, 9, None))
+        low.due, high.due, busy.due, later.due = 0, 1, 0, 50
+        busy.running = True
+
+        scheduler = Scheduler([low, high, busy, later], 2, Mock())
+        self.assertEqual([job.name for job in scheduler.due_jobs(5)], ['high', 'low'])
+        logger.info("test_due_jobs_are_ordered_by_priority passed")
+
+    def test_scheduler_respects_concurrency_cap(self):
+        logger.info("Running test_scheduler_respects_concurrency_cap")
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0, 'runs': 0}
+
+        def run():
+            with lock:
+                state['running'] += 1
+                state['runs'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+
+        jobs = [Job(f'pair{i}', 0.05, 0, run) for i in range(4)]
+        scheduler = Scheduler(jobs, 2, Mock())
+        thread = threading.Thread(target=scheduler.run)
+        thread.start()
+        time.sleep(0.2)
+        scheduler.stop()
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(state['peak'], 2)
+        self.assertGreaterEqual(state['runs'], 4)
+        logger.info("test_scheduler_respects_concurrency_cap passed")
+
+    def test_token_bucket_limits_rate(self):
+        logger.info("Running test_token_bucket_limits_rate")
+        bucket = TokenBucket(1000)
+        start = time.monotonic()
+        # The first 1000 tokens are available immediately, the next 100 take 0.1s
+        bucket.acquire(1000)
+        bucket.acquire(100)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        logger.info("test_token_bucket_limits_rate passed")
+
+    def test_compare_only_pass_is_rate_limited(self):
+        logger.info("Running test_compare_only_pass_is_rate_limited")
+        work_dir = tempfile.mkdtemp()
+        try:
+            for folder in ('source', 'replica'):
+                os.makedirs(os.path.join(work_dir, folder))
+                for i in range(6):
+                    with open(os.path.join(work_dir, folder, f'file{i}.bin'), 'wb') as f:
+                        f.write(bytes(128 * 1024))
+            # 1.5 MiB is hashed against 1 MiB/s, and the first second's worth is available up front
+            budget = ResourceBudget(bandwidth=1024 * 1024)
+            start = time.monotonic()
+            changes_made = sync_folders(os.path.join(work_dir, 'source'), os.path.join(work_dir, 'replica'), Mock(),
+                                        compare='md5', budget=budget)
+            elapsed = time.monotonic() - start
+        finally:
+            shutil.rmtree(work_dir)
+        self.assertEqual(changes_made, 0)
+        self.assertGreaterEqual(elapsed, 0.45)
+        logger.info("test_compare_only_pass_is_rate_limited passed")
+
+    def test_load_config(self):
+        logger.info("Running test_load_config")
+        work_dir = tempfile.mkdtemp()
+        try:
+            config_path = os.path.join(work_dir, 'sync.ini')
+            with open(config_path, 'w') as f:
+                f.write("[daemon]\nlog = /tmp/logs\nmax_concurrent = 3\nbandwidth = 2\n\n"
+                        "[pair:photos]\nsource = /data/photos\nreplica = /backup/photos\ninterval = 60\n"
+                        "priority = 7\ncompare = fast\n\n"
+                        "[pair:docs]\nsource = /data/docs\nreplica = /backup/docs\ninterval = 300\n")
+            config = load_config(config_path)
+
+            self.assertEqual(config.max_concurrent, 3)
+            self.assertEqual(config.bandwidth, 2 * 1024 * 1024)
+            self.assertEqual([pair.name for pair in config.pairs], ['photos', 'docs'])
+            self.assertEqual(config.pairs[0].priority, 7)
+            self.assertEqual(config.pairs[0].compare.tiers, ('size', 'mtime', 'partial', 'full'))
+
+            with open(config_path, 'a') as f:
+                f.write("\n[pair:broken]\nsource = /data/x\nreplica = /backup/x\n")
+            with self.assertRaises(ValueError):
+                load_config(config_path)
+        finally:
+            shutil.rmtree(work_dir)
+        logger.info("test_load_config passed")
+
+
+class TestTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.replica_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.replica_dir)
+
+    def test_sync_through_local_receiver(self):
+        logger.info("Running test_sync_through_local_receiver")
+        os.makedirs(os.path.join(self.source_dir, 'docs', 'old'))
+        for i in range(50):
+            with open(os.path.join(self.source_dir, 'docs', f'note{i}.txt'), 'w') as f:
+                f.write(f"note {i} " * 200)
+        with open(os.path.join(self.source_dir, 'big.bin'), 'wb') as f:
+            f.write(b'x' * (3 * 1024 * 1024 + 17))
+        os.chmod(os.path.join(self.source_dir, 'big.bin'), 0o640)
+        with open(os.path.join(self.replica_dir, 'stale.txt'), 'w') as f:
+            f.write("stale")
+
+        transport = spawn_local_receiver(self.replica_dir, 'zlib', batch_bytes=64 * 1024)
+        try:
+            changes_made = sync_folders(self.source_dir, self.replica_dir, logger, transport=transport)
+            # A second pass finds nothing to send
+            self.assertEqual(sync_folders(self.source_dir, self.replica_dir, logger, transport=transport), 0)
+        finally:
+            transport.close()
+
+        self.assertEqual(changes_made, 54)
+        self.assertFalse(os.path.exists(os.path.join(self.replica_dir, 'stale.txt')))
+        self.assertTrue(os.path.isdir(os.path.join(self.replica_dir, 'docs', 'old')))
+        for rel_path in ('big.bin', os.path.join('docs', 'note7.txt')):
+            source_path = os.path.join(self.source_dir, rel_path)
+            replica_path = os.path.join(self.replica_dir, rel_path)
+            self.assertEqual(file_digest(source_path), file_digest(replica_path))
+            self.assertEqual(os.stat(source_path).st_mtime_ns, os.stat(replica_path).st_mtime_ns)
+        self.assertEqual(os.stat(os.path.join(self.replica_dir, 'big.bin')).st_mode & 0o777, 0o640)
+        logger.info("test_sync_through_local_receiver passed")
+
+    def test_report_covers_operations_since_last_finish(self):
+        logger.info("Running test_report_covers_operations_since_last_finish")
+        for i in range(100):
+            with open(os.path.join(self.source_dir, f'file{i}.txt'), 'w') as f:
+                f.write("same text " * 100)
+
+        transport = spawn_local_receiver(self.replica_dir, 'lzma')
+        try:
+            sync_folders(self.source_dir, self.replica_dir, logger, transport=transport)
+            transport.send_delete(os.path.join(self.replica_dir, 'file0.txt'))
+            report = transport.finish()
+        finally:
+            transport.close()
+
+        self.assertEqual(len(os.listdir(self.replica_dir)), 99)
+        self.assertEqual(report, {'operations': 1, 'batches': 1, 'raw_bytes': report['raw_bytes'],
+                                  'wire_bytes': report['wire_bytes'], 'applied': 1, 'errors': []})
+        logger.info("test_report_covers_operations_since_last_finish passed")
+
+    def test_compression_ratio_and_batch_count(self):
+        logger.info("Running test_compression_ratio_and_batch_count")
+        for i in range(100):
+            with open(os.path.join(self.source_dir, f'file{i}.txt'), 'w') as f:
+                f.write("same text " * 100)
+
+        transport = spawn_local_receiver(self.replica_dir, 'zlib')
+        try:
+            for i in range(100):
+                transport.send_file(os.path.join(self.source_dir, f'file{i}.txt'),
+                                    os.path.join(self.replica_dir, f'file{i}.txt'))
+            report = transport.finish()
+        finally:
+            transport.close()
+
+        # 100 files travel as one batch and one round trip
+        self.assertEqual((report['operations'], report['batches'], report['applied']), (100, 1, 100))
+        self.assertLess(report['wire_bytes'] * 10, report['raw_bytes'])
+        logger.info("test_compression_ratio_and_batch_count passed")
+
+    def test_receiver_rejects_paths_outside_replica(self):
+        logger.info("Running test_receiver_rejects_paths_outside_replica")
+        receiver = Receiver(self.replica_dir)
+        outside = os.path.join(self.source_dir, 'escaped.txt')
+        for path in (os.path.join('..', os.path.basename(self.source_dir), 'escaped.txt'), outside):
+            receiver.apply({'op': 'file', 'path': path, 'offset': 0, 'size': 3, 'last': True,
+                            'mode': 0o644, 'mtime_ns': 0}, b'bad')
+        receiver.apply({'op': 'delete', 'path': '.'}, b'')
+
+        self.assertFalse(os.path.exists(outside))
+        self.assertTrue(os.path.isdir(self.replica_dir))
+        self.assertEqual(len(receiver.errors), 3)
+        self.assertEqual(receiver.applied, 0)
+        logger.info("test_receiver_rejects_paths_outside_replica passed")
+
+    def test_failed_operations_are_reported(self):
+        logger.info("Running test_failed_operations_are_reported")
+        with open(os.path.join(self.source_dir, 'file.txt'), 'w') as f:
+            f.write("content")
+        transport = spawn_local_receiver(self.replica_dir)
+        try:
+            # The parent folder was never created on the replica
+            transport.send_file(os.path.join(self.source_dir, 'file.txt'),
+                                os.path.join(self.replica_dir, 'missing', 'file.txt'))
+            transport.send_mkdir(os.path.join(self.replica_dir, 'made'))
+            report = transport.finish()
+        finally:
+            transport.close()
+
+        self.assertEqual(report['applied'], 1)
+        self.assertEqual(len(report['errors']), 1)
+        self.assertTrue(os.path.isdir(os.path.join(self.replica_dir, 'made')))
+        self.assertEqual(os.listdir(self.replica_dir), ['made'])
+        logger.info("test_failed_operations_are_reported passed")
+
+    def test_failed_multi_chunk_file_is_reported_once(self):
+        logger.info("Running test_failed_multi_chunk_file_is_reported_once")
+        os.makedirs(os.path.join(self.source_dir, 'sub'))
+        with open(os.path.join(self.source_dir, 'sub', 'big.bin'), 'wb') as f:
+            f.write(os.urandom(5 * 1024 * 1024))
+        with open(os.path.join(self.source_dir, 'sub', 'small.txt'), 'w') as f:
+            f.write("content")
+
+        transport = spawn_local_receiver(self.replica_dir, 'none')
+        try:
+            # The parent folder was never created on the replica
+            for name in ('big.bin', 'small.txt'):
+                transport.send_file(os.path.join(self.source_dir, 'sub', name),
+                                    os.path.join(self.replica_dir, 'sub', name))
+            transport.send_mkdir(os.path.join(self.replica_dir, 'sub'))
+            transport.send_file(os.path.join(self.source_dir, 'sub', 'big.bin'),
+                                os.path.join(self.replica_dir, 'sub', 'big.bin'))
+            report = transport.finish()
+        finally:
+            transport.close()
+
+        self.assertEqual(len(report['errors']), 2)
+        self.assertEqual(report['applied'], 2)
+        self.assertEqual(file_digest(os.path.join(self.source_dir, 'sub', 'big.bin')),
+                         file_digest(os.path.join(self.replica_dir, 'sub', 'big.bin')))
+        self.assertEqual(os.listdir(os.path.join(self.replica_dir, 'sub')), ['big.bin'])
+        logger.info("test_failed_multi_chunk_file_is_reported_once passed")
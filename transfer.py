@@ -0,0 +1,295 @@
+import argparse
+import json
+import lzma
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import zlib
+
+# Frame: type, codec, payload length, then the payload
+FRAME_HEADER = struct.Struct('>BBI')
+FRAME_BATCH = 1
+FRAME_SYNC = 2
+FRAME_ACK = 3
+
+CODECS = {
+    'none': (0, lambda data: data, lambda data: data),
+    'zlib': (1, lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (2, lzma.compress, lzma.decompress),
+}
+DECOMPRESSORS = {codec_id: decompress for codec_id, _, decompress in CODECS.values()}
+
+# Inside a batch: metadata length, JSON metadata, then the op's data bytes
+OP_HEADER = struct.Struct('>I')
+
+DEFAULT_BATCH_BYTES = 4 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+def read_exact(stream, size):
+    """Read exactly size bytes, or return None at a clean end of stream."""
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            if data:
+                raise EOFError("The transfer stream ended in the middle of a frame.")
+            return None
+        data += chunk
+    return bytes(data)
+
+def write_frame(stream, frame_type, payload, codec_id=0):
+    stream.write(FRAME_HEADER.pack(frame_type, codec_id, len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+def read_frame(stream):
+    """Return (type, codec id, payload), or None when the peer closed the stream."""
+    header = read_exact(stream, FRAME_HEADER.size)
+    if header is None:
+        return None
+    frame_type, codec_id, length = FRAME_HEADER.unpack(header)
+    payload = read_exact(stream, length) if length else b''
+    if payload is None:
+        raise EOFError("The transfer stream ended in the middle of a frame.")
+    return frame_type, codec_id, payload
+
+class BatchSender:
+    """Packs copies, folder creations and deletions into compressed batches for a receiver.
+
+    Operations are pipelined: nothing waits for the receiver until finish() is
+    called at the end of a pass, which returns the receiver's report.
+    """
+
+    def __init__(self, reader, writer, replica_root, codec='zlib', batch_bytes=DEFAULT_BATCH_BYTES, process=None):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}'. Use one of: {', '.join(CODECS)}.")
+        self.reader = reader
+        self.writer = writer
+        self.replica_root = os.path.abspath(replica_root)
+        self.codec_id, self._compress, _ = CODECS[codec]
+        self.batch_bytes = batch_bytes
+        self._lock = threading.Lock()
+        self._batch = bytearray()
+        self.operations = 0
+        self.batches = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self._process = process
+
+    def _relative(self, replica_path):
+        return os.path.relpath(os.path.abspath(replica_path), self.replica_root)
+
+    def _add(self, meta, data=b''):
+        encoded = json.dumps(meta).encode()
+        with self._lock:
+            self._batch += OP_HEADER.pack(len(encoded)) + encoded + data
+            self.operations += 1
+            if len(self._batch) >= self.batch_bytes:
+                self._send_batch()
+
+    def _send_batch(self):
+        if not self._batch:
+            return
+        payload = self._compress(bytes(self._batch))
+        write_frame(self.writer, FRAME_BATCH, payload, self.codec_id)
+        self.batches += 1
+        self.raw_bytes += len(self._batch)
+        self.wire_bytes += FRAME_HEADER.size + len(payload)
+        self._batch = bytearray()
+
+    def send_file(self, source_path, replica_path):
+        """Queue a file copy, split into chunks so large files do not bloat a batch."""
+        path = self._relative(replica_path)
+        with open(source_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            offset = 0
+            while True:
+                data = f.read(CHUNK_SIZE)
+                last = len(data) < CHUNK_SIZE
+                meta = {'op': 'file', 'path': path, 'offset': offset, 'size': len(data), 'last': last}
+                if last:
+                    meta.update({'mode': st.st_mode & 0o7777, 'mtime_ns': st.st_mtime_ns})
+                self._add(meta, data)
+                offset += len(data)
+                if last:
+                    return
+
+    def send_mkdir(self, replica_path):
+        self._add({'op': 'mkdir', 'path': self._relative(replica_path)})
+
+    def send_delete(self, replica_path):
+        self._add({'op': 'delete', 'path': self._relative(replica_path)})
+
+    def finish(self):
+        """Send the pending batch, wait for the receiver to apply everything and return its report.
+
+        The report also carries the operations, batches and bytes sent since the last finish().
+        """
+        with self._lock:
+            self._send_batch()
+            write_frame(self.writer, FRAME_SYNC, b'')
+            frame = read_frame(self.reader)
+            report = {'operations': self.operations, 'batches': self.batches,
+                      'raw_bytes': self.raw_bytes, 'wire_bytes': self.wire_bytes}
+            self.operations = self.batches = self.raw_bytes = self.wire_bytes = 0
+        if frame is None or frame[0] != FRAME_ACK:
+            raise ConnectionError("The transfer receiver closed the connection.")
+        report.update(json.loads(frame[2]))
+        return report
+
+    def close(self):
+        self.writer.close()
+        self.reader.close()
+        if self._process is not None:
+            self._process.wait()
+
+def spawn_local_receiver(replica_root, codec='zlib', batch_bytes=DEFAULT_BATCH_BYTES):
+    """Start a receiver subprocess for replica_root and return a sender connected to it through pipes."""
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--receive', replica_root],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+    return BatchSender(process.stdout, process.stdin, replica_root, codec, batch_bytes, process)
+
+def connect_receiver(address, replica_root, codec='zlib', batch_bytes=DEFAULT_BATCH_BYTES):
+    """Connect to a receiver listening on host:port and return a sender for it."""
+    host, port = address.rsplit(':', 1)
+    sock = socket.create_connection((host, int(port)))
+    return BatchSender(sock.makefile('rb'), sock.makefile('wb'), replica_root, codec, batch_bytes)
+
+class Receiver:
+    """Applies batches from a sender to the replica folder."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._open_files = {}
+        # Files whose first chunks failed; their remaining chunks are dropped until the last one
+        self._failed = set()
+        self.applied = 0
+        self.errors = []
+
+    def _resolve(self, rel_path):
+        path = os.path.normpath(os.path.join(self.root, rel_path))
+        if os.path.isabs(rel_path) or not path.startswith(self.root + os.sep):
+            raise ValueError(f"Refusing to write outside the replica: '{rel_path}'.")
+        return path
+
+    def _apply_file(self, path, meta, data):
+        if meta['offset'] == 0:
+            self._discard(path)
+            folder, name = os.path.split(path)
+            fd, temp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.synctmp', dir=folder)
+            self._open_files[path] = (os.fdopen(fd, 'wb'), temp_path)
+        f, temp_path = self._open_files[path]
+        f.write(data)
+        if meta['last']:
+            f.close()
+            del self._open_files[path]
+            try:
+                os.chmod(temp_path, meta['mode'])
+                os.utime(temp_path, ns=(meta['mtime_ns'], meta['mtime_ns']))
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                os.replace(temp_path, path)
+            except OSError:
+                os.remove(temp_path)
+                raise
+
+    def _discard(self, path):
+        if path in self._open_files:
+            f, temp_path = self._open_files.pop(path)
+            f.close()
+            os.remove(temp_path)
+
+    def apply(self, meta, data):
+        """Apply a single operation, recording failures instead of stopping the stream.
+
+        A file counts as one operation however many chunks it was sent in, and a
+        file that fails is reported once.
+        """
+        path = None
+        try:
+            if meta['op'] == 'file':
+                if meta['offset'] == 0:
+                    self._failed.discard(meta['path'])
+                elif meta['path'] in self._failed:
+                    if meta['last']:
+                        self._failed.discard(meta['path'])
+                    return
+            path = self._resolve(meta['path'])
+            if meta['op'] == 'file':
+                self._apply_file(path, meta, data)
+                if not meta['last']:
+                    return
+            elif meta['op'] == 'mkdir':
+                os.makedirs(path, exist_ok=True)
+            elif meta['op'] == 'delete':
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                elif os.path.lexists(path):
+                    os.remove(path)
+            else:
+                raise ValueError(f"Unknown operation '{meta['op']}'.")
+            self.applied += 1
+        except Exception as e:
+            if path is not None:
+                self._discard(path)
+            if meta.get('op') == 'file' and not meta.get('last'):
+                self._failed.add(meta.get('path'))
+            self.errors.append(f"{meta.get('op')} {meta.get('path')}: {e}")
+
+    def apply_batch(self, payload):
+        offset = 0
+        while offset < len(payload):
+            (length,) = OP_HEADER.unpack_from(payload, offset)
+            offset += OP_HEADER.size
+            meta = json.loads(payload[offset:offset + length])
+            offset += length
+            size = meta.get('size', 0)
+            self.apply(meta, payload[offset:offset + size])
+            offset += size
+
+    def serve(self, reader, writer):
+        """Apply frames until the sender closes the stream, acknowledging each sync request."""
+        while True:
+            frame = read_frame(reader)
+            if frame is None:
+                break
+            frame_type, codec_id, payload = frame
+            if frame_type == FRAME_BATCH:
+                self.apply_batch(DECOMPRESSORS[codec_id](payload))
+            elif frame_type == FRAME_SYNC:
+                report = {'applied': self.applied, 'errors': self.errors}
+                write_frame(writer, FRAME_ACK, json.dumps(report).encode())
+                self.applied = 0
+                self.errors = []
+                self._failed.clear()
+        for path in list(self._open_files):
+            self._discard(path)
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Folder Synchronization Transfer Receiver')
+    parser.add_argument('--receive', dest="root", type=str, required=True, help='Replica folder to apply received batches to')
+    parser.add_argument('--listen', dest="listen", type=str, default=None, help='host:port to accept senders on; without it batches are read from stdin. The protocol has no authentication, so listen on 127.0.0.1 and reach it through an SSH tunnel')
+    return parser.parse_args()
+
+# Example usage (senders connect through: ssh -N -L 8730:127.0.0.1:8730 replica-host):
+# python transfer.py --receive /srv/replica --listen 127.0.0.1:8730
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.listen is None:
+        Receiver(args.root).serve(sys.stdin.buffer, sys.stdout.buffer)
+    else:
+        host, port = args.listen.rsplit(':', 1)
+        with socket.create_server((host, int(port))) as server:
+            while True:
+                conn, _ = server.accept()
+                with conn, conn.makefile('rb') as reader, conn.makefile('wb') as writer:
+                    Receiver(args.root).serve(reader, writer)
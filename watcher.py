@@ -0,0 +1,177 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    return libc
+
+def inotify_available():
+    """Return True if the platform supports inotify."""
+    return _load_libc() is not None
+
+def reduce_paths(paths):
+    """Drop paths already covered by one of their parent folders."""
+    paths = set(paths)
+    if '' in paths:
+        return ['']
+    reduced = []
+    for path in sorted(paths):
+        parent = os.path.dirname(path)
+        while parent and parent not in paths:
+            parent = os.path.dirname(parent)
+        if not parent:
+            reduced.append(path)
+    return reduced
+
+class InotifyWatcher:
+    """Recursive inotify watch on a folder that reports changed paths relative to it.
+
+    Folders that cannot be watched or listed are skipped with a warning. Running out
+    of watches (ENOSPC) raises OSError, since the tree can then no longer be covered.
+    """
+
+    def __init__(self, root, logger=None):
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError("inotify is not available on this platform.")
+        self.root = root
+        self.logger = logger
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self._watches = {}
+        try:
+            self.add_tree('')
+        except OSError:
+            self.close()
+            raise
+
+    def _skip(self, path, reason):
+        if self.logger is not None:
+            self.logger.warning(f"Cannot watch {path}, changes below it will wait for the next full pass: {reason}")
+
+    def _add_watch(self, rel_path):
+        """Watch a single folder and return whether the watch was added."""
+        path = os.path.join(self.root, rel_path) if rel_path else self.root
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # The folder may already be gone again; the change itself is still reported
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            if err == errno.ENOSPC:
+                raise OSError(err, f"Cannot watch '{path}': the inotify watch limit was reached "
+                                   f"(see fs.inotify.max_user_watches)")
+            self._skip(path, os.strerror(err))
+            return False
+        self._watches[wd] = rel_path
+        return True
+
+    def add_tree(self, rel_path):
+        """Watch a folder and every folder below it."""
+        stack = [rel_path]
+        while stack:
+            current = stack.pop()
+            if not self._add_watch(current):
+                continue
+            path = os.path.join(self.root, current) if current else self.root
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(os.path.join(current, entry.name) if current else entry.name)
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            except OSError as e:
+                self._skip(path, e)
+
+    def read_events(self, timeout):
+        """Wait up to timeout seconds and return (changed paths, overflowed).
+
+        Raises OSError if a new folder cannot be watched because the watch limit was reached.
+        """
+        changed = set()
+        overflowed = False
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return changed, overflowed
+        while True:
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                parent = self._watches.get(wd)
+                if parent is None:
+                    continue
+                if not name:
+                    # Events on the watched folder itself, e.g. IN_DELETE_SELF
+                    changed.add(parent)
+                    continue
+                rel_path = os.path.join(parent, os.fsdecode(name)) if parent else os.fsdecode(name)
+                changed.add(rel_path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(rel_path)
+        return changed, overflowed
+
+    def collect_changes(self, timeout, debounce):
+        """Block until changes arrive, then gather more until the tree is quiet for debounce seconds."""
+        changed, overflowed = self.read_events(timeout)
+        if not changed and not overflowed:
+            return [], False
+        # Cap the debounce window so a constantly written file cannot postpone syncing forever
+        deadline = time.monotonic() + max(debounce * 10, 1)
+        while time.monotonic() < deadline:
+            more, more_overflowed = self.read_events(debounce)
+            if not more and not more_overflowed:
+                break
+            changed |= more
+            overflowed = overflowed or more_overflowed
+        return reduce_paths(changed), overflowed
+
+    def close(self):
+        """Stop watching and release the inotify descriptor."""
+        os.close(self._fd)